@@ -0,0 +1,91 @@
+'''
+Times evaluating the expressions of a scene (Latex \\eval{...} holes and x/y parameters) with the scope of every
+frame, using Python's eval on the source text, eval on code objects compiled once, and the expression engine.
+Usage: python benchmarks/expression_eval.py [scene file] [repetitions]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex_file
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, Context, Latex
+from expressions import Expression
+from display_list import DisplayList
+
+DEFAULT_SCENE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'spinning_text.minm')
+
+def record_scopes(canvas):
+    '''
+    Renders every frame, recording each Latex layer and the scope it is rendered with
+    '''
+
+    workload = []
+    draw = Latex.draw
+
+    def recording_draw(self, ctx, commands, transform):
+        workload.append((self, ctx.scope.flat()))
+        return draw(self, ctx, commands, transform)
+
+    Latex.draw = recording_draw
+    try:
+        context = Context()
+        for frame in range(canvas.length):
+            context.frame = frame
+            canvas.render(context, DisplayList())
+    finally:
+        Latex.draw = draw
+    return workload
+
+def layer_expressions(layer) -> list:
+    return [part for part in layer.template.parts if isinstance(part, Expression)] + \
+           [value for value in (layer.x, layer.y) if isinstance(value, Expression)]
+
+def source_eval(workload):
+    # The original implementation: expressions evaluated from their source text
+    workload = [([expression.source for expression in expressions], scope) for expressions, scope in workload]
+    start = time.perf_counter()
+    for sources, scope in workload:
+        for source in sources:
+            eval(source, scope)
+    return time.perf_counter() - start
+
+def code_eval(workload):
+    # Python code objects compiled once, evaluated with eval
+    workload = [([compile(expression.source, '<expression>', 'eval') for expression in expressions], scope)
+                for expressions, scope in workload]
+    start = time.perf_counter()
+    for codes, scope in workload:
+        for code in codes:
+            eval(code, scope)
+    return time.perf_counter() - start
+
+def engine(workload):
+    start = time.perf_counter()
+    for expressions, scope in workload:
+        for expression in expressions:
+            expression.evaluate(scope)
+    return time.perf_counter() - start
+
+def measure(name: str, function, workload, repetitions: int):
+    # Best of the repetitions, like timeit, as the other runs mostly measure noise
+    evaluations = sum(len(expressions) for expressions, _ in workload)
+    elapsed = min(function(workload) for _ in range(repetitions))
+    print(f'{name:>14}: {elapsed / evaluations * 1e9:.0f} ns/evaluation')
+
+def main():
+    scene = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SCENE
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    canvas = parse_ast(get_canvas_node(parse(TokenStream(lex_file(scene)))))
+    workload = [(layer_expressions(layer), scope) for layer, scope in record_scopes(canvas)]
+    print(f'{os.path.basename(scene)}: {sum(len(expressions) for expressions, _ in workload)} evaluations '
+          f'over {canvas.length} frames, {repetitions} repetitions')
+
+    measure('eval (source)', source_eval, workload, repetitions)
+    measure('eval (code)', code_eval, workload, repetitions)
+    measure('engine', engine, workload, repetitions)
+
+if __name__ == '__main__':
+    main()
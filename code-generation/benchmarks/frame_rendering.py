@@ -0,0 +1,70 @@
+'''
+Times rendering the frames of a mostly static scene whose animations only cover part of the timeline,
+without render reuse, with static subtree reuse, and with render caches for animated layers on top.
+Usage: python benchmarks/frame_rendering.py [number of static blocks] [number of frames]
+'''
+
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, mark_static_layers, attach_render_caches, Context, Layer
+from display_list import DisplayList
+import svg
+
+STATIC_BLOCK = '''
+    Fill(Solid('black'))
+        Rectangle(x: 0, y: 0, width: 200, height: 100)
+    Stroke(Solid('white'), width: 2)
+        Fill(Solid('blue'))
+            Circle(x: 50, y: 50, r: 25)
+            Latex('\\\\textbf{Label} \\\\frac{1}{2} \\\\eval{pi}', x: 20, y: 25)
+'''
+
+ANIMATED_BLOCK = '''
+    Rotate(center: (50, 50), angle: 360, length: 100)
+        Stroke(Solid('red'))
+            Arrow(origin: (50, 50), vector: (25, 0))
+    CircularPath(center: (50, 50), r: 35, length: 100) -> (x, y, p)
+        Fill(Solid('white'))
+            Latex('\\\\textrm{X: }\\\\eval{cos(p)}', x: x, y: y)
+'''
+
+def build_scene(blocks: int, length: int) -> str:
+    return f'Canvas(width: 200, height: 100, length: {length})\n' + STATIC_BLOCK * blocks + ANIMATED_BLOCK
+
+def measure(name: str, canvas: Layer):
+    context = Context()
+    start = time.perf_counter()
+    for frame in range(canvas.length):
+        context.frame = frame
+        canvas.render(context, DisplayList())
+    rendered = time.perf_counter()
+    for frame in range(canvas.length):
+        context.frame = frame
+        commands = DisplayList()
+        canvas.render(context, commands)
+        svg.write(io.StringIO(), commands, canvas.width, canvas.height)
+    written = time.perf_counter()
+
+    print(f'{name:>8}: render {(rendered - start) / canvas.length * 1000:.2f} ms/frame, '
+          f'render + SVG {(written - rendered) / canvas.length * 1000:.2f} ms/frame')
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    canvas = parse_ast(get_canvas_node(parse(TokenStream(lex(build_scene(blocks, length))))))
+    print(f'{blocks} static blocks, {canvas.length} frames, animations over the first 100')
+
+    measure('baseline', canvas)
+    mark_static_layers(canvas)
+    measure('static', canvas)
+    attach_render_caches(canvas)
+    measure('cached', canvas)
+
+if __name__ == '__main__':
+    main()
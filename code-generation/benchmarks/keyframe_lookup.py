@@ -0,0 +1,54 @@
+'''
+Times finding the values of an Animate property for every frame as its number of keyframes grows, with the
+segment lookup table, with a binary search over the keys (what long animations use), and with a linear scan.
+Usage: python benchmarks/keyframe_lookup.py [number of frames] [repetitions]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from layers import Animate
+
+def linear_scan(track, t):
+    # Finds the segment by comparing t with every key in turn
+    if t <= 0:
+        return track.values[0]
+    if t >= 1:
+        return track.values[-1]
+    segment = 0
+    while segment + 2 < len(track.values) and track.positions[segment + 1] <= t:
+        segment += 1
+    u = (t - track.positions[segment]) / track.spans[segment]
+    return track.values[segment] + track.deltas[segment] * track.easing(u)
+
+def measure(arguments, repetitions: int, lookup) -> float:
+    # Best of the repetitions, like timeit
+    best = float('inf')
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for argument in arguments:
+            lookup(argument)
+        best = min(best, time.perf_counter() - start)
+    return best / len(arguments) * 1e9
+
+def main():
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print(f'{length} frames, ns/lookup')
+    print(f'{"keyframes":>10} {"table":>8} {"bisect":>8} {"scan":>8}')
+
+    for keyframes in (2, 10, 100, 1000, length):
+        animation = Animate(length=length, easing='ease-in-out', x=tuple(k % 7 for k in range(keyframes)))
+        track, = animation.tracks
+        offsets = list(range(length))
+        progresses = [animation.effective_time(frame) for frame in offsets]
+
+        table = measure(offsets, repetitions, track.frame_value)
+        bisected = measure(progresses, repetitions, track.value)
+        scan = measure(progresses, 1, lambda t: linear_scan(track, t))
+        print(f'{keyframes:>10} {table:>8.0f} {bisected:>8.0f} {scan:>8.0f}')
+
+if __name__ == '__main__':
+    main()
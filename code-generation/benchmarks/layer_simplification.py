@@ -0,0 +1,65 @@
+'''
+Times rendering the frames of a scene written with redundant wrapper layers (repeated styles, identity transforms),
+as parsed and after simplify_layers.
+Usage: python benchmarks/layer_simplification.py [number of blocks] [number of frames]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, simplify_layers, mark_static_layers, attach_render_caches, Context, Layer
+from display_list import DisplayList
+
+BLOCK = '''
+    Translate(x: 0, y: 0)
+        Fill(Solid('blue'))
+            Fill(Solid('red'))
+                Rotate(center: (50, 50), angle: 360, length: 100)
+                    Stroke(Solid('white'))
+                        Stroke(width: 2)
+                            Circle(x: 50, y: 20, r: 5)
+                    Stroke(Solid('white'))
+                        Stroke(width: 2)
+                            Rectangle(x: 40, y: 40, width: 20, height: 20)
+        Fill(Solid('blue'))
+            Rotate(center: (50, 50), angle: 0)
+                Circle(x: 'p * 10', y: 5, r: 2)
+'''
+
+def build_scene(blocks: int, length: int) -> str:
+    return f'Canvas(width: 100, height: 100, length: {length})\n' + \
+           '    CircularPath(center: (50, 50), r: 35, length: 100) -> (x, y, p)\n' + \
+           BLOCK.replace('\n    ', '\n        ') * blocks
+
+def count_layers(layer: Layer) -> int:
+    return 1 + sum(count_layers(child) for child in getattr(layer, 'children', []))
+
+def measure(name: str, canvas: Layer):
+    mark_static_layers(canvas)
+    attach_render_caches(canvas)
+    context = Context()
+    start = time.perf_counter()
+    for frame in range(canvas.length):
+        context.frame = frame
+        canvas.render(context, DisplayList())
+    elapsed = time.perf_counter() - start
+    print(f'{name:>10}: {count_layers(canvas):>5} layers, render {elapsed / canvas.length * 1000:.3f} ms/frame')
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    canvas = parse_ast(get_canvas_node(parse(TokenStream(lex(build_scene(blocks, length))))))
+    print(f'{blocks} blocks, {canvas.length} frames')
+
+    measure('parsed', canvas)
+    start = time.perf_counter()
+    simplified = simplify_layers(canvas)
+    print(f'simplify_layers: {(time.perf_counter() - start) * 1000:.2f} ms')
+    measure('simplified', simplified)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Compares the whole-string lexer path (read the file, then lex) with the streaming mmap path.
+Usage: python benchmarks/lexer_throughput.py [size in MB]
+'''
+
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex, lex_file
+
+SCENE_BLOCK = '''
+    # Rotating arrow
+    Rotate(center: (50, 50), angle: 360, length: 100)
+        Stroke(Solid('red'))
+            Arrow(origin: (50, 50), vector: (25, 0))
+
+    CircularPath(center: (50, 50), r: 35, length: 100) -> (x, y, p)
+        Fill(Solid('white'))
+            Latex('\\textrm{X: }\\eval{cos(p)} \\textrm{Y: }\\eval{sin(p)}', x: x, y: y)
+'''
+
+def write_scene(path: str, size: int):
+    with open(path, 'w') as f:
+        f.write('Canvas(width: 200, height: 100, length: 100)\n')
+        written = 0
+        while written < size:
+            f.write(SCENE_BLOCK)
+            written += len(SCENE_BLOCK)
+
+def measure(name: str, function, path: str, size: int):
+    start = time.perf_counter()
+    buffer = function(path)
+    elapsed = time.perf_counter() - start
+    del buffer
+
+    # Memory is measured in a separate run, tracemalloc slows allocations down too much to time them
+    tracemalloc.start()
+    buffer = function(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    token_memory = sum(a.itemsize * len(a) for a in (buffer.types, buffer.starts, buffer.ends, buffer.line_starts))
+    print(f'{name:>12}: {elapsed:.2f}s, {size / elapsed / 1e6:.1f} MB/s, {len(buffer)} tokens, '
+          f'peak {peak / 1e6:.1f} MB (of which {token_memory / 1e6:.1f} MB token arrays)')
+
+def read_and_lex(path: str):
+    with open(path, 'r') as f:
+        return lex(f.read())
+
+def main():
+    size = int(float(sys.argv[1]) * 1e6) if len(sys.argv) > 1 else 5_000_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'scene.minm')
+        write_scene(path, size)
+        size = os.path.getsize(path)
+        print(f'Scene: {size / 1e6:.1f} MB')
+
+        measure('whole-string', read_and_lex, path, size)
+        measure('mmap', lex_file, path, size)
+
+if __name__ == '__main__':
+    main()
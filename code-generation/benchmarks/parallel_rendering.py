@@ -0,0 +1,54 @@
+'''
+Times writing all the frames of an animated scene with main.render in 1, 2, 4, ... worker processes, up to the
+number of CPUs.
+Usage: python benchmarks/parallel_rendering.py [number of animated blocks] [number of frames]
+'''
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, analyze_layers
+import main as miml
+
+ANIMATED_BLOCK = '''
+    Rotate(center: (50, 50), angle: 360, length: {length})
+        Stroke(Solid('red'))
+            Arrow(origin: (50, 50), vector: (25, 0))
+    CircularPath(center: (50, 50), r: 35, length: {length}) -> (x, y, p)
+        Fill(Solid('white'))
+            Latex('\\\\textrm{{X: }}\\\\eval{{cos(p)}}', x: x, y: y)
+            Repeat(count: 10, x: 'i * 5') -> (i)
+                Circle(x: 'x + i', y: y, r: 2)
+'''
+
+def build_scene(blocks: int, length: int) -> str:
+    return f'Canvas(width: 200, height: 100, length: {length})\n' + ANIMATED_BLOCK.format(length=length) * blocks
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    source = build_scene(blocks, length)
+    print(f'{blocks} animated blocks, {length} frames, {os.cpu_count()} CPUs')
+
+    serial = None
+    jobs = 1
+    while jobs <= (os.cpu_count() or 1):
+        canvas = parse_ast(get_canvas_node(parse(TokenStream(lex(source)))))
+        analyze_layers(canvas)
+        with tempfile.TemporaryDirectory() as output_dir, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            miml.render(canvas, output_dir, jobs)
+            elapsed = time.perf_counter() - start
+        serial = serial or elapsed
+        print(f'{jobs:>4} jobs: {elapsed:.2f} s, {length / elapsed:.0f} frames/s, speedup {serial / elapsed:.2f}')
+        jobs *= 2
+
+if __name__ == '__main__':
+    main()
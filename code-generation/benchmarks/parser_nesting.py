@@ -0,0 +1,82 @@
+'''
+Compiles deeply nested and very wide scenes, which used to exceed Python's recursion limit, and renders the layer
+trees to SVG frames.
+Usage: python benchmarks/parser_nesting.py [depth] [width] [frames]
+'''
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, analyze_layers, simplify_layers
+from main import FrameRenderer
+
+HEADER = 'Canvas(width: 200, height: 100, length: {frames})\n'
+
+def deep_layers(depth: int, frames: int) -> str:
+    # Tabs keep the source size quadratic in the depth with a small constant.
+    # Every other level is animated, so no level is simplified away and the tree is rendered again for every frame.
+    lines = [HEADER.format(frames=frames)]
+    for level in range(1, depth + 1):
+        window = f', start: 0, length: {frames}' if level % 2 and frames > 1 else ''
+        lines.append('\t' * level + f'Translate(x: 1, y: 1{window})\n')
+    lines.append('\t' * (depth + 1) + "Circle(x: 0, y: 0, r: 1)\n")
+    return ''.join(lines)
+
+def wide_layers(width: int, frames: int) -> str:
+    lines = [HEADER.format(frames=frames), '\tFill(Solid(\'red\'))\n']
+    lines.extend('\t\tCircle(x: 0, y: 0, r: 1)\n' for _ in range(width))
+    return ''.join(lines)
+
+def deep_params(depth: int) -> str:
+    value = '{a: ' * depth + '1' + '}' * depth
+    return HEADER.format(frames=1) + f'\tCircle(x: 0, y: 0, r: 1, data: {value})\n'
+
+def deep_calls(depth: int) -> str:
+    value = 'Solid(' * depth + "'red'" + ')' * depth
+    return HEADER.format(frames=1) + f'\tFill({value})\n\t\tCircle(x: 0, y: 0, r: 1)\n'
+
+def measure(name: str, source: str, build_layers=True):
+    start = time.perf_counter()
+    buffer = lex(source)
+    lexed = time.perf_counter()
+    ast = parse(TokenStream(buffer))
+    parsed = time.perf_counter()
+    if not build_layers:
+        print(f'{name:>12}: {len(source) / 1e6:.1f} MB, {len(buffer)} tokens, lex {lexed - start:.2f}s, '
+              f'parse {parsed - lexed:.2f}s')
+        return
+
+    canvas = parse_ast(get_canvas_node(ast))
+    analyze_layers(canvas)
+    built = time.perf_counter()
+
+    # Like main.render in a single process
+    renderer = FrameRenderer(simplify_layers(canvas))
+    with tempfile.TemporaryDirectory() as output_dir:
+        for frame in range(canvas.length):
+            renderer.write(frame, output_dir)
+    rendered = time.perf_counter()
+
+    print(f'{name:>12}: {len(source) / 1e6:.1f} MB, {len(buffer)} tokens, lex {lexed - start:.2f}s, '
+          f'parse {parsed - lexed:.2f}s, layers {built - parsed:.2f}s, '
+          f'render {(rendered - built) / canvas.length * 1e3:.1f} ms/frame')
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    frames = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f'Depth {depth}, width {width}, {frames} frames (recursion limit {sys.getrecursionlimit()})')
+
+    measure('deep layers', deep_layers(depth, frames))
+    measure('wide layers', wide_layers(width, frames))
+    # Layers don't accept arbitrary Dicts yet, so only the syntax tree is built for them
+    measure('deep dicts', deep_params(depth), build_layers=False)
+    measure('deep calls', deep_calls(depth), build_layers=False)
+
+if __name__ == '__main__':
+    main()
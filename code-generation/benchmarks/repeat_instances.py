@@ -0,0 +1,64 @@
+'''
+Times compiling and rendering a grid of shapes written out one line per shape, and with a Repeat layer whose
+instances share a <defs> template or read the index themselves.
+Usage: python benchmarks/repeat_instances.py [number of shapes] [number of frames]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, mark_static_layers, attach_render_caches, Context
+from xml.etree.ElementTree import tostring
+from display_list import DisplayList
+import svg
+import optimizer
+
+def written_out(count: int) -> str:
+    lines = [f'        Circle(x: {i % 100 * 10 + 5}, y: {i // 100 * 10 + 5}, r: 4)\n' for i in range(count)]
+    return '    Fill(Solid(\'red\'))\n' + ''.join(lines)
+
+def repeat_template(count: int) -> str:
+    return ("    Fill(Solid('red'))\n"
+            f"        Repeat(count: {count}, x: 'i % 100 * 10', y: 'i // 100 * 10') -> (i)\n"
+            "            Circle(x: 5, y: 5, r: 4)\n")
+
+def repeat_index(count: int) -> str:
+    return ("    Fill(Solid('red'))\n"
+            f"        Repeat(count: {count}) -> (i)\n"
+            "            Circle(x: 'i % 100 * 10 + 5', y: 'i // 100 * 10 + 5', r: 4)\n")
+
+def measure(name: str, body: str, length: int):
+    source = f'Canvas(width: 1000, height: 1000, length: {length})\n' + body
+    start = time.perf_counter()
+    canvas = parse_ast(get_canvas_node(parse(TokenStream(lex(source)))))
+    compiled = time.perf_counter()
+
+    mark_static_layers(canvas)
+    attach_render_caches(canvas)
+    context = Context()
+    for frame in range(length):
+        context.frame = frame
+        commands = DisplayList()
+        canvas.render(context, commands)
+    rendered = time.perf_counter()
+    output = tostring(optimizer.optimize_svg(svg.to_element(commands, canvas.width, canvas.height)))
+    optimized = time.perf_counter()
+
+    print(f'{name:>16}: {len(source):>6} source bytes, compile {(compiled - start) * 1000:6.1f} ms, '
+          f'render {(rendered - compiled) / length * 1000:6.1f} ms/frame, '
+          f'optimize {(optimized - rendered) * 1000:6.1f} ms, {len(output):>6} SVG bytes')
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print(f'{count} circles, {length} frames')
+    measure('written out', written_out(count), length)
+    measure('Repeat, template', repeat_template(count), length)
+    measure('Repeat, index', repeat_index(count), length)
+
+if __name__ == '__main__':
+    main()
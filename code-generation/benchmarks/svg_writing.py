@@ -0,0 +1,75 @@
+'''
+Times turning the display lists of a scene's frames into SVG text: building the element tree, optimizing and
+serializing it with ElementTree, and writing the text straight from the display list, with and without baking
+translations into coordinates first.
+Usage: python benchmarks/svg_writing.py [grid size] [number of frames]
+'''
+
+import io
+import os
+import sys
+import time
+from xml.etree.ElementTree import tostring
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, mark_static_layers, attach_render_caches, Context
+from display_list import DisplayList
+import svg
+import optimizer
+
+def build_scene(size: int, length: int) -> str:
+    return f'''Canvas(width: {size * 10}, height: {size * 10}, length: {length})
+    Repeat(count: {size}, y: 'j * 10') -> (j)
+        Repeat(count: {size}, x: 'i * 10') -> (i)
+            Stroke(Solid('white'), width: 1)
+                Fill(Solid('blue'))
+                    Rectangle(x: 0, y: 0, width: 8, height: 8)
+    Rotate(center: (50, 50), angle: 360, length: {length})
+        Fill(Solid('red'))
+            Circle(x: 50, y: 20, r: 5)
+            Latex('\\\\textbf{{A}} B', x: 50, y: 30)
+    Translate(x: 10, y: 5)
+        Translate(x: 5, y: 0, length: {length})
+            Fill(Solid('green'))
+                Circle(x: 5, y: 5, r: 2)
+                Rectangle(x: 0, y: 0, width: 4, height: 2)
+'''
+
+def measure(name: str, frames, write):
+    # Best of 3, like timeit
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for commands in frames:
+            write(commands)
+        best = min(best, time.perf_counter() - start)
+    print(f'{name:>23}: {best / len(frames) * 1000:.3f} ms/frame')
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    canvas = parse_ast(get_canvas_node(parse(TokenStream(lex(build_scene(size, length))))))
+    mark_static_layers(canvas)
+    attach_render_caches(canvas)
+
+    context = Context()
+    frames = []
+    for frame in range(length):
+        context.frame = frame
+        commands = DisplayList()
+        canvas.render(context, commands)
+        frames.append(commands)
+    print(f'{size}x{size} grid, {length} frames, {len(frames[0])} commands/frame')
+
+    width, height = canvas.width, canvas.height
+    measure('element tree', frames, lambda commands: tostring(svg.to_element(commands, width, height)))
+    measure('element tree + optimize', frames,
+            lambda commands: tostring(optimizer.optimize_svg(svg.to_element(commands, width, height))))
+    measure('direct', frames, lambda commands: svg.write(io.StringIO(), commands, width, height))
+    measure('folded + direct', frames,
+            lambda commands: svg.write(io.StringIO(), optimizer.fold_translations(commands), width, height))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+'''
+Times computing the animation values of every animated layer over a long timeline, frame by frame in Python
+and at once with NumPy (precompute_timelines), then rendering the frames with and without the timelines.
+Usage: python benchmarks/timeline_evaluation.py [number of animated blocks] [number of frames]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lexical_analyser import lex
+from parser import parse, TokenStream
+from layers import parse_ast, get_canvas_node, precompute_timelines, Context, Layer
+import layers
+from display_list import DisplayList
+
+ANIMATED_BLOCK = '''
+    Translate(x: 40, y: 10, start: {start}, length: {length})
+        Rotate(center: (50, 50), angle: 360, start: {start}, length: {length})
+            Stroke(Solid('red'))
+                Arrow(origin: (50, 50), vector: (25, 0))
+    CircularPath(center: (50, 50), r: 35, start: {start}, length: {length}) -> (x, y, p, a)
+        Fill(Solid('white'))
+            Circle(x: x, y: y, r: 2)
+'''
+
+def build_scene(blocks: int, length: int) -> str:
+    # Animations of different lengths, spread over the timeline
+    scene = f'Canvas(width: 200, height: 100, length: {length})\n'
+    for i in range(blocks):
+        animation_length = length // (i % 4 + 1)
+        scene += ANIMATED_BLOCK.format(start=(length - animation_length) * i // blocks, length=animation_length)
+    return scene
+
+def animated_layers(root: Layer) -> list:
+    found = []
+    stack = [root]
+    while stack:
+        layer = stack.pop()
+        if layer.effective_time(0) is not None:
+            found.append(layer)
+        stack.extend(getattr(layer, 'children', []))
+    return found
+
+def main():
+    if layers.numpy is None:
+        sys.exit('NumPy is not installed')
+
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    length = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    canvas = parse_ast(get_canvas_node(parse(TokenStream(lex(build_scene(blocks, length))))))
+    animated = animated_layers(canvas)
+    print(f'{len(animated)} animated layers, {length} frames')
+
+    start = time.perf_counter()
+    scalar = [[layer.frame_values(frame) for layer in animated] for frame in range(length)]
+    python_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    precompute_timelines(canvas, length)
+    precompute_time = time.perf_counter() - start
+    batched = [[layer.frame_values(frame) for layer in animated] for frame in range(length)]
+    batched_time = time.perf_counter() - start
+
+    # The rows must hold exactly the values, and the same int or float types, that the frame by frame path computes
+    assert batched == scalar and all(repr(a) == repr(b) for x, y in zip(batched, scalar) for a, b in zip(x, y))
+    print(f'{"values frame by frame":>24}: {python_time * 1000:.0f} ms')
+    print(f'{"values from timelines":>24}: {batched_time * 1000:.0f} ms, of which {precompute_time * 1000:.0f} ms precomputing')
+
+    context = Context()
+    for name, timelines in (('render without timelines', False), ('render with timelines', True)):
+        for layer in animated:
+            layer._timeline = None
+        if timelines:
+            precompute_timelines(canvas, length)
+
+        start = time.perf_counter()
+        for frame in range(length):
+            context.frame = frame
+            canvas.render(context, DisplayList())
+        print(f'{name:>24}: {(time.perf_counter() - start) / length * 1e6:.0f} µs/frame')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+'''
+Checks the expression engine against Python's eval on random expressions: the closures, the stack program used for
+deep expressions, unpickled expressions and the batched evaluation of Repeat instances must give the values eval
+gives, and raise the errors it raises. Exits with status 1 on any difference.
+Usage: python checks/expression_engine.py [expressions] [seed]
+'''
+
+import os
+import sys
+import math
+import pickle
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from expressions import Expression, MAX_POWER_BITS, compile_program, evaluate_instances, parse_expression, run_program
+
+SCOPE = {'sin': math.sin, 'cos': math.cos, 'atan': math.atan, 'pi': math.pi, 'e': math.e,
+         'x': 3.25, 'y': -7, 'p': 0.5, 'a': 12, 'f2': lambda a, b: a * 2 - b, 'f0': lambda: 4}
+LEAVES = ['x', 'y', 'p', 'a', 'i', 'pi', 'e', '2', '3', '0', '1.5', '.25', '1e2', '10', '7']
+EXPONENTS = ['2', '-1', '0.5', '(-2)', 'p', '-p', 'i', '3 ** 2', '-2**2', '300', '0']
+INSTANCES = 5
+
+# Expressions eval can't be compared on, with the error the engine raises
+CAPPED = ['9**9**9', f'2**{MAX_POWER_BITS}', f'(-3)**(10*{MAX_POWER_BITS})', '((9**256)**256)**256', '(9**9999)**9999',
+          '(a**(a*a))**(a*a)', '((a**a)**a)**(a*a*a)', '(-(a**a))**(a*a*a)']
+
+def random_expression(rng: random.Random, depth: int) -> str:
+    r = rng.random()
+    if depth <= 0 or r < 0.2:
+        return rng.choice(LEAVES)
+    if r < 0.35:
+        return rng.choice(['-', '+', '- ']) + random_expression(rng, depth - 1)
+    if r < 0.5:
+        return '(' + random_expression(rng, depth - 1) + ')'
+    if r < 0.6:
+        return rng.choice(['sin', 'cos', 'atan']) + '(' + random_expression(rng, depth - 1) + ')'
+    if r < 0.65:
+        return 'f2(' + random_expression(rng, depth - 1) + ', ' + random_expression(rng, depth - 1) + ')'
+    if r < 0.67:
+        return 'f0()'
+    if r < 0.75:
+        return random_expression(rng, 0) + '**' + rng.choice(EXPONENTS)
+    return random_expression(rng, depth - 1) + rng.choice([' + ', '-', ' * ', ' / ', '//', ' % ']) + \
+        random_expression(rng, depth - 1)
+
+def outcome(function):
+    # The value, or the type of the error raised
+    try:
+        return 'value', repr(function())
+    except Exception as e:
+        return 'error', type(e).__name__
+
+def check(source: str) -> list:
+    '''
+    The differences between eval and the engine on an expression, for every instance index
+    '''
+
+    differences = []
+    expression = Expression(source)
+    program = compile_program(parse_expression(source)[0])
+    unpickled = pickle.loads(pickle.dumps(expression))
+    expected = []
+    for i in range(INSTANCES):
+        scope = dict(SCOPE, i=i)
+        expected.append(outcome(lambda: eval(source, dict(scope))))
+        for name, function in (('closure', expression.evaluate), ('program', lambda scope: run_program(program, scope)),
+                               ('unpickled', unpickled.evaluate)):
+            result = outcome(lambda: function(scope))
+            if result != expected[-1]:
+                differences.append(f'{name} with i={i}: {result}, eval: {expected[-1]}')
+
+    # A batch raises as soon as an instance does, so only the values are compared one by one
+    batched = outcome(lambda: evaluate_instances(expression, SCOPE, 'i', INSTANCES))
+    if any(kind == 'error' for kind, _ in expected):
+        if batched[0] != 'error':
+            differences.append(f'batched: {batched}, eval: {expected}')
+    elif batched != ('value', '[' + ', '.join(value for _, value in expected) + ']'):
+        differences.append(f'batched: {batched}, eval: {expected}')
+    return differences
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+
+    failures = 0
+    for _ in range(count):
+        source = random_expression(rng, rng.randint(1, 6))
+        differences = check(source)
+        if differences:
+            failures += 1
+            print(f'{source}:', *differences, sep='\n    ')
+
+    # Constant folding must leave them to evaluation, and every way of evaluating them must raise
+    for source in CAPPED:
+        expression = Expression(source)
+        program = compile_program(parse_expression(source)[0])
+        results = {'closure': outcome(lambda: expression.evaluate(SCOPE)),
+                   'program': outcome(lambda: run_program(program, SCOPE)),
+                   'batched': outcome(lambda: evaluate_instances(expression, SCOPE, 'i', INSTANCES))}
+        differences = [f'{name}: {result}' for name, result in results.items() if result != ('error', 'OverflowError')]
+        if differences:
+            failures += 1
+            print(f'{source}:', *differences, 'expected OverflowError', sep='\n    ')
+
+    print(f'{count + len(CAPPED)} expressions, {failures} with differences')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
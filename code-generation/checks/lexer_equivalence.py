@@ -0,0 +1,130 @@
+'''
+Checks the DFA lexer against the lexer it replaced, which is still the one of the parsing stage (parsing/), on the
+example scenes, the test files of the earlier stages and random strings. Exits with status 1 on any difference.
+Usage: python checks/lexer_equivalence.py [random strings] [seed]
+
+The old lexer printed a flat stream where whitespace of 4 spaces or a tab is an INDENT token. The DFA lexer drops
+whitespace inside lines and emits NEWLINE/INDENT/DEDENT block structure instead, so the expected stream is built from
+the old one: its state is reset at every newline, which lets it lex the source one line at a time, and the INDENT
+tokens starting each line give the line's indentation level.
+'''
+
+import io
+import os
+import sys
+import random
+import contextlib
+import importlib.util
+from glob import glob
+
+REPOSITORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(REPOSITORY, 'code-generation'))
+from lexical_analyser import lex, lex_bytes
+
+INPUTS = ['code-generation/examples/*.minm', 'parsing/test-*.txt', 'lexical-analysis/test*.txt']
+ALPHABET = list("aZ9 \t\n#(){}:,->'\"x!é²€.") + ['    ', '\n    ', '\n\t']
+SMALL_CHUNK = 3 # Chunk size that makes tokens and comments cross chunk boundaries
+
+def load_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def load_reference():
+    # The old lexer imports its own tokens module, which has the name of the one of code-generation
+    directory = os.path.join(REPOSITORY, 'parsing')
+    tokens = sys.modules['tokens']
+    try:
+        sys.modules['tokens'] = load_module('reference_tokens', os.path.join(directory, 'tokens.py'))
+        return load_module('reference_lexer', os.path.join(directory, 'lexical_analyser.py'))
+    finally:
+        sys.modules['tokens'] = tokens
+
+def reference_line(reference, line: str) -> tuple:
+    '''
+    The (type, value) tokens and the error messages the old lexer prints for a line
+    '''
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        reference.tokenize(line)
+
+    tokens = []
+    errors = []
+    for printed in output.getvalue().splitlines():
+        if printed.startswith(':: LEXICAL ERROR :: '):
+            errors.append(printed[len(':: LEXICAL ERROR :: '):])
+        else:
+            separator = printed.index(', ')
+            tokens.append((printed[1:separator], printed[separator + 3:-2]))
+    return tokens, errors
+
+def expected(reference, source: str) -> tuple:
+    '''
+    The tokens and errors the DFA lexer should give for the source, from the old lexer
+    '''
+
+    tokens = []
+    errors = []
+    depth = 0
+    lines = source.split('\n')
+    for number, line in enumerate(lines):
+        # Every line but the last still ends with its newline, which ends tokens without the end of input checks
+        line_tokens, line_errors = reference_line(reference, line if number == len(lines) - 1 else line + '\n')
+        errors.extend(line_errors)
+
+        level = 0
+        while level < len(line_tokens) and line_tokens[level][0] == 'INDENT':
+            level += 1
+        line_tokens = [token for token in line_tokens if token[0] != 'INDENT']
+        if not line_tokens:
+            continue # Blank lines and comments don't change the indentation
+
+        tokens.extend([('INDENT', '')] * (level - depth) + [('DEDENT', '')] * (depth - level))
+        depth = level
+        tokens.extend(line_tokens)
+        tokens.append(('NEWLINE', ''))
+
+    tokens.extend([('DEDENT', '')] * depth)
+    return tokens, errors
+
+def lexed(buffer) -> tuple:
+    return [(token.type, token.value) for token in buffer], [message for message, _ in buffer.errors]
+
+def check(reference, source: str) -> list:
+    '''
+    The ways of lexing the source that don't give the expected tokens and errors
+    '''
+
+    expected_output = expected(reference, source)
+    results = {
+        'lex': lexed(lex(source, report_errors=False)),
+        'lex, small chunks': lexed(lex(source, SMALL_CHUNK, report_errors=False)),
+        'lex_bytes, small chunks': lexed(lex_bytes(source.encode('utf-8'), SMALL_CHUNK, report_errors=False)),
+    }
+    return [name for name, output in results.items() if output != expected_output]
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+    reference = load_reference()
+
+    files = sorted(path for pattern in INPUTS for path in glob(os.path.join(REPOSITORY, pattern)))
+    sources = [(os.path.relpath(path, REPOSITORY), open(path, encoding='utf-8').read()) for path in files]
+    for _ in range(count):
+        source = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 30)))
+        sources.append((repr(source), source))
+
+    failures = 0
+    for name, source in sources:
+        differences = check(reference, source)
+        if differences:
+            failures += 1
+            print(f'{name}: {", ".join(differences)} differ')
+
+    print(f'{len(files)} files and {count} random strings, {failures} with differences')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
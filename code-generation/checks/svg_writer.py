@@ -0,0 +1,132 @@
+'''
+Checks that svg.write writes exactly what ElementTree.tostring writes for svg.to_element, on every frame of the
+example scenes (with and without translations folded into coordinates) and on random display lists whose values
+include strings that would break out of attributes or text if they weren't escaped. Every document written must
+also parse back to the values it was written from. Exits with status 1 on any difference.
+Usage: python checks/svg_writer.py [random display lists] [seed]
+'''
+
+import io
+import os
+import sys
+import random
+import xml.etree.ElementTree as ET
+from glob import glob
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from main import compile_file
+from layers import mark_static_layers, attach_render_caches, precompute_timelines, Context
+from display_list import DisplayList, RECT, CIRCLE, LINE, TEXT, IDENTITY, translation, rotation
+import svg
+import optimizer
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', '*.minm')
+HOSTILE = ['1)" onload="alert(1)', '"<>', "'&amp;", '</svg><script>x</script>', 'a\nb\tc\rd', 'é€²', '', '100%']
+COLORS = ['red', '#00ff00', None] + HOSTILE
+
+def value(rng: random.Random):
+    r = rng.random()
+    if r < 0.4:
+        return rng.randint(-50, 50)
+    if r < 0.8:
+        return rng.uniform(-50, 50)
+    return rng.choice(HOSTILE)
+
+def transform(rng: random.Random) -> tuple:
+    r = rng.random()
+    if r < 0.4:
+        return IDENTITY
+    if r < 0.8:
+        return translation(value(rng), value(rng))
+    if r < 0.9:
+        return rotation(rng.uniform(0, 360), 1, 2)
+    return tuple(value(rng) for _ in range(6))
+
+def random_list(rng: random.Random, depth: int) -> DisplayList:
+    commands = DisplayList()
+    for _ in range(rng.randint(0, 8)):
+        kind = rng.choice([RECT, CIRCLE, LINE, TEXT, 'template'] if depth else [RECT, CIRCLE, LINE, TEXT])
+        if kind == 'template':
+            template_id = commands.define(random_list(rng, depth - 1), rng.choice(['repeat', 'static']))
+            commands.use(template_id, transform(rng))
+            continue
+
+        if kind == RECT:
+            geometry = tuple(value(rng) for _ in range(4))
+        elif kind == CIRCLE:
+            geometry = tuple(value(rng) for _ in range(3))
+        elif kind == LINE:
+            geometry = tuple(value(rng) for _ in range(4))
+        else:
+            geometry = (value(rng), value(rng), rng.choice(HOSTILE + ['A', 'x + 1']), value(rng))
+        commands.add(kind, geometry, (rng.choice(COLORS), rng.choice(COLORS), value(rng)), transform(rng))
+    return commands
+
+def contents(root: ET.Element) -> list:
+    # The tag, attributes and text of every element, without the namespace parsing adds. Empty text parses as None,
+    # and like ElementTree, the writer leaves carriage returns in text as they are, which parse as newlines.
+    return [(element.tag.rsplit('}', 1)[-1], {k: v for k, v in element.attrib.items() if k != 'xmlns'},
+             element.text.replace('\r', '\n') if element.text else None) for element in root.iter()]
+
+def check(commands: DisplayList, width, height) -> list:
+    '''
+    The ways the written SVG of a display list differs from ElementTree's
+    '''
+
+    buffer = io.StringIO()
+    svg.write(buffer, commands, width, height)
+    written = buffer.getvalue()
+    element = svg.to_element(commands, width, height)
+    if written != ET.tostring(element).decode('ascii'):
+        return ['differs from ElementTree']
+
+    # Whatever the values hold, they must parse back unchanged
+    try:
+        parsed = ET.fromstring(written)
+    except ET.ParseError as e:
+        return [f'does not parse: {e}']
+    if contents(parsed) != contents(element):
+        return ['parses to other values']
+    return []
+
+def example_frames():
+    for path in sorted(glob(EXAMPLES)):
+        canvas, _ = compile_file(path)
+        if canvas is None:
+            continue
+        mark_static_layers(canvas)
+        attach_render_caches(canvas)
+        precompute_timelines(canvas, canvas.length)
+        context = Context()
+        for frame in range(canvas.length):
+            context.frame = frame
+            commands = DisplayList()
+            canvas.render(context, commands)
+            yield f'{os.path.basename(path)} frame {frame + 1}', commands, canvas.width, canvas.height
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = random.Random(int(sys.argv[2]) if len(sys.argv) > 2 else 0)
+
+    failures = 0
+    checked = 0
+    for name, commands, width, height in example_frames():
+        for variant, variant_commands in (('', commands), (', folded', optimizer.fold_translations(commands))):
+            checked += 1
+            differences = check(variant_commands, width, height)
+            if differences:
+                failures += 1
+                print(f'{name}{variant}: {", ".join(differences)}')
+
+    for i in range(count):
+        checked += 1
+        differences = check(random_list(rng, 2), value(rng), value(rng))
+        if differences:
+            failures += 1
+            print(f'random display list {i}: {", ".join(differences)}')
+
+    print(f'{checked} display lists, {failures} with differences')
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import os
+import pickle
+import hashlib
+import contextlib
+from typing import Callable, List, Optional, Tuple
+from layers import Canvas
+from diagnostics import Diagnostic
+
+# Compiled scenes are stored as pickled layer trees, named after a hash of the source and of the compiler itself.
+# Editing any of the compiler modules changes the hash, so stale entries are never read, they just age out.
+# main defines what is compiled and cached (compile_file), and display_list classes are pickled with the layers.
+COMPILER_MODULES = ['tokens', 'lexical_analyser', 'parser', 'syntax_tree', 'layers', 'diagnostics', 'expressions',
+                    'display_list', 'main', 'compile_cache']
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'miml')
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024 # Bytes
+
+ENTRY_SUFFIX = '.pickle'
+
+def compiler_version() -> str:
+    '''
+    Returns a hash of the source of the compiler modules
+    '''
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for module in COMPILER_MODULES:
+        with open(os.path.join(directory, module + '.py'), 'rb') as f:
+            digest.update(module.encode('utf-8') + b'\0')
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class CompileCache:
+    '''
+    Content-addressed cache of compiled scenes in a directory.
+    The least recently used entries (by file modification time, updated on every hit) are evicted
+    when the directory grows over max_size bytes.
+    '''
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.version = compiler_version()
+
+    def key(self, path: str) -> str:
+        '''
+        Returns the cache key of a source file
+        '''
+
+        digest = hashlib.sha256(self.version.encode('ascii'))
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def load(self, key: str) -> Optional[Tuple[Canvas, List[Diagnostic]]]:
+        '''
+        Returns the cached Canvas layer and diagnostics for the key, or None on a miss
+        '''
+
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated or unreadable entry, compile again
+            self._remove(path)
+            return None
+
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return entry
+
+    def store(self, key: str, canvas: Optional[Canvas], diagnostics: List[Diagnostic]):
+        '''
+        Stores a compiled scene (None if it has errors) and its diagnostics, then evicts old entries if needed
+        '''
+
+        try:
+            data = pickle.dumps((canvas, diagnostics), protocol=pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return # Layer tree too deep to pickle, it just won't be cached
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.entry_path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path) # Concurrent runs never see a partially written entry
+
+        self.evict()
+
+    def entries(self):
+        '''
+        Returns (modification time, size, path) for every entry of the cache
+        '''
+
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                with contextlib.suppress(OSError):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits in max_size
+        '''
+
+        entries = self.entries()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove(path)
+            total_size -= size
+
+    def clear(self):
+        '''
+        Removes every entry of the cache
+        '''
+
+        for _, _, path in self.entries():
+            self._remove(path)
+
+    def _remove(self, path: str):
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+def compile_cached(path: str, compile: Callable[[str], Tuple[Optional[Canvas], List[Diagnostic]]],
+                   cache: Optional[CompileCache]) -> Tuple[Optional[Canvas], List[Diagnostic]]:
+    '''
+    Compiles the file with compile(path), which returns the Canvas layer and the diagnostics,
+    or loads both from the cache when the same source was compiled before
+    '''
+
+    if cache is None:
+        return compile(path)
+
+    key = cache.key(path)
+    entry = cache.load(key)
+    if entry is not None:
+        return entry
+
+    canvas, diagnostics = compile(path)
+    cache.store(key, canvas, diagnostics)
+    return canvas, diagnostics
@@ -0,0 +1,60 @@
+import json
+from typing import List, Optional, Tuple
+
+LEXICAL = 'lexical'
+SYNTAX = 'syntax'
+SEMANTIC = 'semantic'
+
+class Diagnostic:
+    '''
+    A problem found while compiling a scene: its kind (lexical, syntax or semantic), message and 1-based
+    (line, column) position, if known
+    '''
+
+    __slots__ = ('kind', 'message', 'position')
+
+    def __init__(self, kind: str, message: str, position: Optional[Tuple[int, int]] = None):
+        self.kind = kind
+        self.message = message
+        self.position = position
+
+    def format(self, filename: str = None) -> str:
+        location = ''
+        if self.position is not None:
+            location = f'{self.position[0]}:{self.position[1]}: '
+        if filename is not None:
+            location = f'{filename}:{location}'
+        return f'{location}{self.kind} error: {self.message}'
+
+    def to_dict(self) -> dict:
+        line, column = self.position if self.position is not None else (None, None)
+        return {'kind': self.kind, 'message': self.message, 'line': line, 'column': column}
+
+    def __str__(self):
+        return self.format()
+
+def is_fatal(diagnostics: List[Diagnostic]) -> bool:
+    '''
+    Lexical errors only drop the offending characters, so only syntax and semantic errors prevent rendering
+    '''
+
+    return any(diagnostic.kind != LEXICAL for diagnostic in diagnostics)
+
+def sort_diagnostics(diagnostics: List[Diagnostic]) -> List[Diagnostic]:
+    '''
+    Orders diagnostics by position, keeping the order in which they were found for equal positions
+    '''
+
+    return sorted(diagnostics, key=lambda diagnostic: diagnostic.position or (0, 0))
+
+def format_report(diagnostics: List[Diagnostic], filename: str = None) -> str:
+    lines = [diagnostic.format(filename) for diagnostic in sort_diagnostics(diagnostics)]
+    counts = {kind: 0 for kind in (LEXICAL, SYNTAX, SEMANTIC)}
+    for diagnostic in diagnostics:
+        counts[diagnostic.kind] += 1
+    lines.append(', '.join(f'{count} {kind} error{"" if count == 1 else "s"}' for kind, count in counts.items()))
+    return '\n'.join(lines)
+
+def json_report(diagnostics: List[Diagnostic], filename: str = None) -> str:
+    return json.dumps({'file': filename, 'diagnostics': [diagnostic.to_dict() for diagnostic in sort_diagnostics(diagnostics)]},
+                      indent=2)
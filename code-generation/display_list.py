@@ -0,0 +1,105 @@
+import hashlib
+import math
+from typing import Dict, List
+
+# What layers render into: a flat list of draw commands, each with the style it is drawn with and the affine
+# transform from its coordinates to the canvas, accumulated from the layers above it. Backends like the SVG writer
+# (svg.py) only ever read the list, never the layer tree.
+
+# Kinds of draw command, and their geometry:
+# RECT (x, y, width, height), CIRCLE (x, y, r), LINE (x1, y1, x2, y2), TEXT (x, y, text, font size),
+# USE (template id,): the commands of a template, see DisplayList.define
+RECT, CIRCLE, LINE, TEXT, USE = range(5)
+
+# Affine transforms are (a, b, c, d, e, f) tuples like SVG's matrix(a, b, c, d, e, f), mapping (x, y) to
+# (a * x + c * y + e, b * x + d * y + f)
+IDENTITY = (1, 0, 0, 1, 0, 0)
+
+def translation(x, y) -> tuple:
+    return (1, 0, 0, 1, x, y)
+
+def rotation(angle, cx, cy) -> tuple:
+    '''
+    Rotation by angle degrees around (cx, cy), like SVG's rotate(angle, cx, cy)
+    '''
+
+    cos = math.cos(angle * math.pi / 180)
+    sin = math.sin(angle * math.pi / 180)
+    return (cos, sin, -sin, cos, cx - cos * cx + sin * cy, cy - sin * cx - cos * cy)
+
+def multiply(m: tuple, n: tuple) -> tuple:
+    '''
+    The transform applying n, then m. Translations compose by adding their offsets, which keeps integer offsets exact.
+    '''
+
+    if n == IDENTITY:
+        return m
+    if m == IDENTITY:
+        return n
+    a, b, c, d, e, f = m
+    if a == d == 1 and b == c == 0 and n[:4] == (1, 0, 0, 1):
+        return (1, 0, 0, 1, e + n[4], f + n[5])
+    na, nb, nc, nd, ne, nf = n
+    return (a * na + c * nb, b * na + d * nb, a * nc + c * nd, b * nc + d * nd, a * ne + c * nf + e, b * ne + d * nf + f)
+
+def is_translation(m: tuple) -> bool:
+    return m[0] == m[3] == 1 and m[1] == m[2] == 0
+
+class DisplayList:
+    '''
+    Draw commands stored column by column: kinds[i], geometry[i], styles[i] (the (fill color, stroke color,
+    stroke width) it is drawn with) and transforms[i] describe the i-th command, in painting order.
+    templates holds the display lists that USE commands draw, by id.
+    Display lists are never modified once a layer has rendered them, so render caches can share them.
+    '''
+
+    __slots__ = ('kinds', 'geometry', 'styles', 'transforms', 'templates')
+
+    def __init__(self):
+        self.kinds: List[int] = []
+        self.geometry: List[tuple] = []
+        self.styles: List[tuple] = []
+        self.transforms: List[tuple] = []
+        self.templates: Dict[str, 'DisplayList'] = {}
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def add(self, kind: int, geometry: tuple, style: tuple, transform: tuple = IDENTITY):
+        self.kinds.append(kind)
+        self.geometry.append(geometry)
+        self.styles.append(style)
+        self.transforms.append(transform)
+
+    def extend(self, commands: 'DisplayList', transform: tuple = IDENTITY):
+        '''
+        Appends the commands of another display list, drawn with transform
+        '''
+
+        self.kinds.extend(commands.kinds)
+        self.geometry.extend(commands.geometry)
+        self.styles.extend(commands.styles)
+        if transform == IDENTITY:
+            self.transforms.extend(commands.transforms)
+        else:
+            self.transforms.extend([multiply(transform, m) for m in commands.transforms])
+        self.templates.update(commands.templates)
+
+    def define(self, template: 'DisplayList', prefix: str) -> str:
+        '''
+        Adds a template that USE commands can draw any number of times, and returns its id.
+        The id is the prefix and the whole hash of the content of the template, so the same template always gets
+        the same id and different templates never share one, as templates are merged by id from many display lists.
+        Backends write shorter ids (see svg.element_id).
+        '''
+
+        template_id = f'{prefix}-{template.digest()}'
+        self.templates.update(template.templates)
+        self.templates[template_id] = template
+        return template_id
+
+    def use(self, template_id: str, transform: tuple = IDENTITY):
+        self.add(USE, (template_id,), None, transform)
+
+    def digest(self) -> str:
+        return hashlib.sha1(repr((self.kinds, self.geometry, self.styles, self.transforms)).encode('utf-8')).hexdigest()
@@ -0,0 +1,588 @@
+import re
+import math
+import operator
+from types import MappingProxyType
+from typing import List, Mapping, Union
+
+try:
+    import numpy
+except ImportError: # Optional, instances are then evaluated one by one
+    numpy = None
+
+# The expression language is the arithmetic subset of Python used in layer parameters: numbers, names,
+# + - * / // % ** (** binds tighter than unary minus and is right associative), parentheses and calls like cos(p).
+# Names are only looked up in the scope an expression is evaluated in, with scope[name]: there is no attribute access
+# and no fallback to the Python builtins.
+
+_TOKEN_PATTERN = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)|([^\W\d]\w*)|(\*\*|//|[-+*/%(),]))')
+NUMBER_TOKEN, NAME_TOKEN, SYMBOL_TOKEN = 1, 2, 3 # Match group of each token kind
+
+# Syntax tree nodes are tuples starting with their kind:
+# (CONSTANT, value), (NAME, name), (UNARY, function, operand), (BINARY, function, left, right), (CALL, name, arguments)
+CONSTANT, NAME, UNARY, BINARY, CALL = range(5)
+
+# Integer powers whose result could have more bits raise OverflowError, when folded or evaluated, rather than
+# hanging the compiler or the renderer on numbers like 9**9**9 or ((9**256)**256)**256
+MAX_POWER_BITS = 2**16
+
+def power(a, b):
+    '''
+    a ** b, except for integer powers with more than MAX_POWER_BITS bits, which raise OverflowError like float powers
+    that are too large. Arrays of Python numbers (see evaluate_instances) are raised element by element.
+    '''
+
+    if type(a) is int and type(b) is int and b > 0 and abs(a).bit_length() * b > MAX_POWER_BITS and abs(a) > 1:
+        raise OverflowError('integer power too large')
+    if numpy is not None and (type(a) is numpy.ndarray or type(b) is numpy.ndarray):
+        return _object_power(a, b)
+    return a ** b
+
+if numpy is not None:
+    _object_power = numpy.frompyfunc(power, 2, 1)
+
+# Symbol: (function, precedence, right associative)
+BINARY_OPERATORS = {
+    '+': (operator.add, 1, False),
+    '-': (operator.sub, 1, False),
+    '*': (operator.mul, 2, False),
+    '/': (operator.truediv, 2, False),
+    '//': (operator.floordiv, 2, False),
+    '%': (operator.mod, 2, False),
+    '**': (power, 4, True),
+}
+UNARY_OPERATORS = {'-': operator.neg, '+': operator.pos}
+UNARY_PRECEDENCE = 3
+
+# Deeper expressions are compiled to a stack program instead of nested closures, which would hit the recursion limit
+MAX_CLOSURE_DEPTH = 100
+
+# Kinds of the parser's operator stack entries
+_OPERATOR, _PREFIX, _PARENTHESIS, _FUNCTION = range(4)
+
+# Stack program instructions
+_PUSH, _LOAD, _APPLY_UNARY, _APPLY_BINARY, _CALL_FUNCTION = range(5)
+
+def tokenize(source: str) -> List[tuple]:
+    '''
+    Splits an expression into (kind, text) tokens, kind being one of NUMBER_TOKEN, NAME_TOKEN and SYMBOL_TOKEN
+    '''
+
+    tokens = []
+    position = 0
+    end = len(source.rstrip())
+    while position < end:
+        match = _TOKEN_PATTERN.match(source, position)
+        if match is None:
+            raise SyntaxError(f'Unexpected character {source[position:].lstrip()[0]!r}')
+        tokens.append((match.lastindex, match.group(match.lastindex)))
+        position = match.end()
+    return tokens
+
+def _fold_unary(function, operand) -> tuple:
+    if operand[0] == CONSTANT:
+        return (CONSTANT, function(operand[1]))
+    return (UNARY, function, operand)
+
+def _fold_binary(function, left, right) -> tuple:
+    if left[0] == CONSTANT and right[0] == CONSTANT:
+        try:
+            return (CONSTANT, function(left[1], right[1]))
+        except ArithmeticError:
+            pass # Raised when evaluating instead, like Python would, or by power for results too large
+    return (BINARY, function, left, right)
+
+def _reduce(operators: list, operands: list):
+    '''
+    Applies the operator on top of the operator stack to the (node, depth) pairs on top of the operand stack
+    '''
+
+    entry = operators.pop()
+    if entry[0] == _PREFIX:
+        operand, depth = operands.pop()
+        operands.append((_fold_unary(entry[1], operand), depth + 1))
+    else:
+        right, right_depth = operands.pop()
+        left, left_depth = operands.pop()
+        operands.append((_fold_binary(entry[1], left, right), max(left_depth, right_depth) + 1))
+
+def _fold_call(name: str, arguments: tuple, constants: frozenset) -> tuple:
+    if name in constants and callable(BUILTINS[name]) and all(argument[0] == CONSTANT for argument in arguments):
+        try:
+            return (CONSTANT, BUILTINS[name](*[argument[1] for argument in arguments]))
+        except (ArithmeticError, ValueError, TypeError):
+            pass # Raised when evaluating instead, like math.acos(2)
+    return (CALL, name, arguments)
+
+def _reduce_function(entry: list, operands: list, constants: frozenset):
+    count = entry[2]
+    arguments = operands[len(operands) - count:]
+    del operands[len(operands) - count:]
+    depth = max(depth for _, depth in arguments) + 1
+    operands.append((_fold_call(entry[1], tuple(node for node, _ in arguments), constants), depth))
+
+def tree_names(tree) -> frozenset:
+    '''
+    Names read by a syntax tree, as values or functions
+    '''
+
+    names = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        kind = node[0]
+        if kind == NAME:
+            names.add(node[1])
+        elif kind == CALL:
+            names.add(node[1])
+            stack.extend(node[2])
+        elif kind != CONSTANT:
+            stack.extend(node[2:])
+    return frozenset(names)
+
+def tree_functions(tree) -> frozenset:
+    '''
+    Names called by a syntax tree
+    '''
+
+    functions = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        kind = node[0]
+        if kind == CALL:
+            functions.add(node[1])
+            stack.extend(node[2])
+        elif kind != CONSTANT and kind != NAME:
+            stack.extend(node[2:])
+    return frozenset(functions)
+
+def parse_expression(source: str, constants: frozenset = frozenset()):
+    '''
+    Parses an expression into a constant-folded syntax tree, using operator precedence (shunting-yard)
+    with explicit stacks rather than recursion. Returns the tree, its depth and the names it reads.
+    The builtins named in constants (those no layer shadows where the expression is evaluated) are folded too.
+    Raises SyntaxError for anything outside of the expression language.
+    '''
+
+    tokens = tokenize(source)
+    if not tokens:
+        raise SyntaxError('Empty expression')
+
+    operators = [] # [kind, function or function name, precedence or argument count]
+    operands = []
+    expect_operand = True
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        i += 1
+        if expect_operand:
+            if kind == NUMBER_TOKEN:
+                operands.append(((CONSTANT, int(text) if text.isdigit() else float(text)), 1))
+                expect_operand = False
+            elif kind == NAME_TOKEN:
+                if i < len(tokens) and tokens[i][1] == '(':
+                    if i + 1 < len(tokens) and tokens[i + 1][1] == ')':
+                        operands.append((_fold_call(text, (), constants), 1))
+                        expect_operand = False
+                        i += 2
+                    else:
+                        operators.append([_FUNCTION, text, 1])
+                        i += 1
+                elif text in constants and not callable(BUILTINS[text]):
+                    operands.append(((CONSTANT, BUILTINS[text]), 1))
+                    expect_operand = False
+                else:
+                    operands.append(((NAME, text), 1))
+                    expect_operand = False
+            elif text in UNARY_OPERATORS:
+                operators.append([_PREFIX, UNARY_OPERATORS[text], UNARY_PRECEDENCE])
+            elif text == '(':
+                operators.append([_PARENTHESIS, None, None])
+            else:
+                raise SyntaxError(f'Unexpected {text!r}')
+        elif text in BINARY_OPERATORS:
+            function, precedence, right_associative = BINARY_OPERATORS[text]
+            while operators and operators[-1][0] in (_OPERATOR, _PREFIX) and \
+                    (operators[-1][2] > precedence or (operators[-1][2] == precedence and not right_associative)):
+                _reduce(operators, operands)
+            operators.append([_OPERATOR, function, precedence])
+            expect_operand = True
+        elif text == ',' or text == ')':
+            while operators and operators[-1][0] in (_OPERATOR, _PREFIX):
+                _reduce(operators, operands)
+            if not operators or (text == ',' and operators[-1][0] != _FUNCTION):
+                raise SyntaxError(f'Unexpected {text!r}')
+
+            if text == ',':
+                operators[-1][2] += 1
+                expect_operand = True
+            else:
+                entry = operators.pop()
+                if entry[0] == _FUNCTION:
+                    _reduce_function(entry, operands, constants)
+        else:
+            raise SyntaxError(f'Unexpected {text!r}')
+
+    if expect_operand:
+        raise SyntaxError('Unexpected end of expression')
+
+    while operators:
+        if operators[-1][0] in (_PARENTHESIS, _FUNCTION):
+            raise SyntaxError("Missing ')'")
+        _reduce(operators, operands)
+
+    tree, depth = operands.pop()
+    return tree, depth, tree_names(tree)
+
+def is_arithmetic(tree) -> bool:
+    '''
+    Whether the tree only uses + - * / // % and unary operators, which NumPy computes on int64 and float64 arrays
+    exactly like Python does on ints and floats (barring overflows), unlike powers and functions
+    '''
+
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node[0] == CALL or (node[0] == BINARY and node[1] is power):
+            return False
+        if node[0] == UNARY:
+            stack.append(node[2])
+        elif node[0] == BINARY:
+            stack.extend(node[2:])
+    return True
+
+def compile_closure(tree):
+    '''
+    Compiles a syntax tree into nested closures taking the scope. Names and constants are read inline by the closure
+    of the node using them rather than through closures of their own, which saves a call per operand.
+    Recursive, see MAX_CLOSURE_DEPTH.
+    '''
+
+    kind = tree[0]
+    if kind == CONSTANT:
+        value = tree[1]
+        return lambda scope: value
+    if kind == NAME:
+        return operator.itemgetter(tree[1])
+
+    if kind == UNARY:
+        function, operand = tree[1], tree[2]
+        if operand[0] == NAME:
+            name = operand[1]
+            return lambda scope: function(scope[name])
+        operand = compile_closure(operand)
+        return lambda scope: function(operand(scope))
+
+    if kind == BINARY:
+        function, left, right = tree[1:]
+        left_kind, right_kind = left[0], right[0]
+        left = left[1] if left_kind in (CONSTANT, NAME) else compile_closure(left)
+        right = right[1] if right_kind in (CONSTANT, NAME) else compile_closure(right)
+        if left_kind == NAME:
+            if right_kind == NAME:
+                return lambda scope: function(scope[left], scope[right])
+            if right_kind == CONSTANT:
+                return lambda scope: function(scope[left], right)
+            return lambda scope: function(scope[left], right(scope))
+        if left_kind == CONSTANT:
+            if right_kind == NAME:
+                return lambda scope: function(left, scope[right])
+            if right_kind == CONSTANT:
+                # Left unfolded because it raises or is too large to compute when compiling, see _fold_binary
+                return lambda scope: function(left, right)
+            return lambda scope: function(left, right(scope))
+        if right_kind == NAME:
+            return lambda scope: function(left(scope), scope[right])
+        if right_kind == CONSTANT:
+            return lambda scope: function(left(scope), right)
+        return lambda scope: function(left(scope), right(scope))
+
+    name, arguments = tree[1], tree[2]
+    if len(arguments) == 1:
+        argument = arguments[0]
+        if argument[0] == NAME:
+            argument = argument[1]
+            return lambda scope: scope[name](scope[argument])
+        if argument[0] == CONSTANT:
+            argument = argument[1]
+            return lambda scope: scope[name](argument)
+        argument = compile_closure(argument)
+        return lambda scope: scope[name](argument(scope))
+    arguments = [compile_closure(argument) for argument in arguments]
+    return lambda scope: scope[name](*[argument(scope) for argument in arguments])
+
+def compile_program(tree) -> list:
+    '''
+    Compiles a syntax tree into a postfix list of (instruction, argument) pairs for run_program
+    '''
+
+    program = []
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        kind = node[0]
+        if kind == CONSTANT:
+            program.append((_PUSH, node[1]))
+        elif kind == NAME:
+            program.append((_LOAD, node[1]))
+        elif visited:
+            if kind == UNARY:
+                program.append((_APPLY_UNARY, node[1]))
+            elif kind == BINARY:
+                program.append((_APPLY_BINARY, node[1]))
+            else:
+                program.append((_CALL_FUNCTION, (node[1], len(node[2]))))
+        else:
+            stack.append((node, True))
+            operands = node[2:] if kind != CALL else node[2]
+            stack.extend((operand, False) for operand in reversed(operands))
+    return program
+
+def run_program(program: list, scope: dict):
+    stack = []
+    for instruction, argument in program:
+        if instruction == _PUSH:
+            stack.append(argument)
+        elif instruction == _LOAD:
+            stack.append(scope[argument])
+        elif instruction == _APPLY_UNARY:
+            stack[-1] = argument(stack[-1])
+        elif instruction == _APPLY_BINARY:
+            right = stack.pop()
+            stack[-1] = argument(stack[-1], right)
+        else:
+            name, count = argument
+            start = len(stack) - count
+            arguments = stack[start:]
+            del stack[start:]
+            stack.append(scope[name](*arguments))
+    return stack[0]
+
+class Expression:
+    '''
+    An expression in a layer parameter, like the x: x of Latex or the A of \\eval{A}.
+    It is parsed, folded and compiled once, when the layer is created, and only evaluated when rendering.
+    constants are the builtins folded with it, see parse_expression and fold_value.
+    '''
+
+    # evaluate(scope) is the compiled closure itself, to save a method call per evaluation
+    __slots__ = ('source', 'constants', 'names', 'functions', 'constant', 'arithmetic', 'evaluate')
+
+    def __init__(self, source: str, constants: frozenset = frozenset()):
+        self.source = source
+        self.constants = constants
+        tree, depth, self.names = parse_expression(source, constants) # Names the expression reads
+        self.functions = tree_functions(tree) # Those it calls
+        self.constant = tree[0] == CONSTANT
+        self.arithmetic = is_arithmetic(tree)
+        if depth <= MAX_CLOSURE_DEPTH:
+            self.evaluate = compile_closure(tree)
+        else:
+            program = compile_program(tree)
+            self.evaluate = lambda scope: run_program(program, scope)
+
+    def __reduce__(self):
+        # Closures can't be pickled, compile again when unpickling
+        return Expression, (self.source, self.constants)
+
+    def __repr__(self):
+        return f'Expression({self.source!r})'
+
+class Scope:
+    '''
+    The names visible to expressions. A scope is persistent: it only holds the bindings it adds or overrides and
+    a link to its parent scope, so deriving one never copies what it inherits. Expressions are evaluated
+    in flat(), a dict of every visible name, built the first time it is needed.
+    '''
+
+    __slots__ = ('parent', 'bindings', '_flat')
+
+    def __init__(self, bindings: Mapping, parent: 'Scope' = None):
+        self.parent = parent
+        self.bindings = bindings
+        self._flat = None
+
+    def child(self, bindings: dict) -> 'Scope':
+        '''
+        Returns a scope with the given bindings on top of this one
+        '''
+
+        return Scope(bindings, self) if bindings else self
+
+    def __getitem__(self, name: str):
+        scope = self
+        while scope is not None:
+            if scope._flat is not None:
+                return scope._flat[name]
+            if name in scope.bindings:
+                return scope.bindings[name]
+            scope = scope.parent
+        raise KeyError(name)
+
+    def flat(self) -> dict:
+        if self._flat is None:
+            chain = []
+            scope = self
+            while scope is not None and scope._flat is None:
+                chain.append(scope)
+                scope = scope.parent
+
+            flat = dict(scope._flat) if scope is not None else {}
+            for scope in reversed(chain):
+                flat.update(scope.bindings)
+            self._flat = flat
+        return self._flat
+
+# Names available to every expression, shared by all scopes
+BUILTINS = MappingProxyType({name: getattr(math, name) for name in ('sin', 'cos', 'tan', 'atan', 'asin', 'acos', 'pi', 'e')})
+BASE_SCOPE = Scope(BUILTINS)
+
+# The builtin functions applied to each element of an array of Python numbers, see evaluate_instances
+if numpy is not None:
+    _OBJECT_FUNCTIONS = {name: numpy.frompyfunc(value, 1, 1) for name, value in BUILTINS.items() if callable(value)}
+
+def compile_value(value):
+    '''
+    Compiles string parameter values to Expressions, other values are constants and are returned as is.
+    Raises SyntaxError for invalid expressions.
+    '''
+
+    if isinstance(value, str):
+        return Expression(value)
+    return value
+
+def evaluate(value, scope: dict):
+    '''
+    Evaluates a value returned by compile_value
+    '''
+
+    if isinstance(value, Expression):
+        return value.evaluate(scope)
+    return value
+
+def evaluate_instances(value, scope: dict, index: str, count: int) -> list:
+    '''
+    Evaluates a value returned by compile_value for every instance of a Repeat, with index bound to 0 to count - 1.
+    Expressions reading the index are evaluated once over a NumPy array of indices when NumPy is installed,
+    otherwise one instance at a time. Returns the list of values, exactly the same as evaluating each instance would.
+    '''
+
+    if not isinstance(value, Expression) or index not in value.names:
+        return [evaluate(value, scope)] * count
+
+    if numpy is not None and count > 0:
+        values = _evaluate_typed_array(value, scope, index, count) if value.arithmetic else None
+        if values is None:
+            values = _evaluate_object_array(value, scope, index, count)
+        return values
+
+    scope = dict(scope)
+    values = []
+    for i in range(count):
+        scope[index] = i
+        values.append(value.evaluate(scope))
+    return values
+
+def _evaluate_typed_array(expression: Expression, scope: dict, index: str, count: int):
+    '''
+    Evaluates an arithmetic expression over an int64 array of indices. Returns None if that could differ from Python:
+    on errors, which Python reports differently, and when evaluating over a float64 array of the same indices
+    doesn't give the same result, as happens when int64 arithmetic overflows.
+    '''
+
+    array_scope = dict(scope)
+    try:
+        with numpy.errstate(all='raise'):
+            array_scope[index] = numpy.arange(count)
+            result = numpy.broadcast_to(expression.evaluate(array_scope), (count,))
+            array_scope[index] = numpy.arange(count, dtype=float)
+            check = numpy.broadcast_to(expression.evaluate(array_scope), (count,))
+    except (ArithmeticError, ValueError, TypeError):
+        return None
+
+    if result.dtype.kind not in 'if' or not numpy.array_equal(result, check):
+        return None
+    return result.tolist()
+
+def _evaluate_object_array(expression: Expression, scope: dict, index: str, count: int) -> list:
+    '''
+    Evaluates an expression over an array of Python ints. NumPy applies the Python operators and the builtin
+    functions to each element from C, so the values (and errors) are the ones Python would give.
+    '''
+
+    array_scope = dict(scope)
+    array_scope[index] = numpy.arange(count, dtype=object)
+    for name, function in _OBJECT_FUNCTIONS.items():
+        if array_scope.get(name) is BUILTINS[name]:
+            array_scope[name] = function
+    return numpy.broadcast_to(numpy.asarray(expression.evaluate(array_scope), dtype=object), (count,)).tolist()
+
+def fold_value(value, constants: frozenset):
+    '''
+    Compiles a value returned by compile_value again with the builtins named in constants folded.
+    Expressions that fold to a constant are replaced by their value, like other constant parameters.
+    '''
+
+    if not isinstance(value, Expression):
+        return value
+    if not value.names.isdisjoint(constants):
+        value = Expression(value.source, constants)
+    return value.evaluate(None) if value.constant else value
+
+def value_names(value) -> frozenset:
+    '''
+    Names read by a value returned by compile_value
+    '''
+
+    if isinstance(value, Expression):
+        return value.names
+    return frozenset()
+
+def value_functions(value) -> frozenset:
+    '''
+    Names called by a value returned by compile_value
+    '''
+
+    if isinstance(value, Expression):
+        return value.functions
+    return frozenset()
+
+_EVAL_PATTERN = re.compile(r'\\eval\{(.+?)\}')
+
+class Template:
+    '''
+    Text with \\eval{A} holes, split once into static text segments and compiled expressions.
+    Rendering it only evaluates the expressions and joins the segments.
+    '''
+
+    __slots__ = ('parts', 'names', 'functions')
+
+    def __init__(self, text: str, constants: frozenset = frozenset()):
+        # re.split with a group alternates text and the contents of the \\eval{...} holes.
+        # Holes that fold to a constant (see fold_value) are rendered once, into the text around them.
+        self.parts: List[Union[str, Expression]] = []
+        for i, part in enumerate(_EVAL_PATTERN.split(text)):
+            if i % 2:
+                part = fold_value(Expression(part, constants), constants)
+                if isinstance(part, Expression):
+                    self.parts.append(part)
+                    continue
+                part = str(part)
+            if part and self.parts and type(self.parts[-1]) is str:
+                self.parts[-1] += part
+            elif part:
+                self.parts.append(part)
+
+        self.names = frozenset().union(*(value_names(part) for part in self.parts))
+        self.functions = frozenset().union(*(value_functions(part) for part in self.parts))
+
+    def render(self, scope: dict) -> str:
+        return ''.join([part if type(part) is str else str(part.evaluate(scope)) for part in self.parts])
+
+    def __getstate__(self):
+        return self.parts
+
+    def __setstate__(self, parts):
+        self.parts = parts
+        self.names = frozenset().union(*(value_names(part) for part in parts))
+        self.functions = frozenset().union(*(value_functions(part) for part in parts))
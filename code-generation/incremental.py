@@ -0,0 +1,202 @@
+from bisect import bisect_right
+from typing import List
+from lexical_analyser import lex, INDENT_CODE, DEDENT_CODE, NEWLINE_CODE
+from parser import parse, parse_children, expect, TokenStream, ParsingError
+from syntax_tree import LayerNode
+from tokens import TokenBuffer
+from layers import Layer, Canvas, parse_ast, analyze_layers, create_layer, get_canvas_node
+
+# The lexer's state is reset at every newline, and the only state carried from one line to the next is the
+# indentation depth. A line that starts a direct child of the Canvas (a top-level block) is always at depth 1,
+# so each top-level block can be lexed and parsed on its own and the result spliced into the previous tree.
+
+def split_lines(source: str) -> List[str]:
+    '''
+    Splits the source into lines, keeping the newline characters. Only '\\n' ends a line, like in the lexer.
+    '''
+
+    lines = source.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+def block_start_lines(buffer: TokenBuffer, allow_top_level=False) -> List[int]:
+    '''
+    Returns the (0-based) lines of the buffer on which a top-level block starts.
+    Unless allowed, a line at depth 0 (which only the Canvas line may be) is a parsing error.
+    '''
+
+    starts = []
+    depth = 0
+    line_start = True
+    types = buffer.types
+    for index in range(len(types)):
+        code = types[index]
+        if code == INDENT_CODE:
+            depth += 1
+        elif code == DEDENT_CODE:
+            depth -= 1
+        elif code == NEWLINE_CODE:
+            line_start = True
+        elif line_start:
+            line_start = False
+            if depth == 0 and not allow_top_level:
+                raise ParsingError('Unexpected top-level layer', buffer.position(index))
+            if depth == 1:
+                starts.append(buffer.position(index)[0] - 1)
+
+    return starts
+
+class Block:
+    '''
+    A top-level block: a direct child of the Canvas with its source lines, syntax tree and layer.
+    The lines include any comments and blank lines that follow the block.
+    '''
+
+    __slots__ = ('lines', 'node', 'layer')
+
+    def __init__(self, lines: List[str], node: LayerNode, layer: Layer):
+        self.lines = lines
+        self.node = node
+        self.layer = layer
+
+class IncrementalCompiler:
+    '''
+    Compiles a scene and recompiles it after edits, re-lexing and re-parsing only the top-level blocks
+    containing changed lines. Untouched blocks keep their syntax tree and layer objects.
+    '''
+
+    def __init__(self, source: str):
+        self.compile(source)
+
+    def compile(self, source: str) -> Canvas:
+        '''
+        Compiles the whole source from scratch
+        '''
+
+        lines = split_lines(source)
+        buffer = lex(source)
+        ast = parse(TokenStream(buffer))
+        canvas_node = get_canvas_node(ast)
+        canvas = parse_ast(canvas_node)
+        analyze_layers(canvas)
+
+        nodes = canvas_node.children
+        starts = block_start_lines(buffer, allow_top_level=True)
+        ends = starts[1:] + [len(lines)]
+
+        self.ast = ast
+        self.canvas = canvas
+        self.header = lines[:starts[0]] if starts else lines
+        self.blocks = [Block(lines[start:end], node, layer)
+                       for start, end, node, layer in zip(starts, ends, nodes, canvas.children)]
+        self.lines = lines
+        return canvas
+
+    def update(self, source: str) -> Canvas:
+        '''
+        Recompiles the scene after an edit and returns the new Canvas layer
+        '''
+
+        old_lines = self.lines
+        new_lines = split_lines(source)
+
+        # Find the changed range of lines
+        prefix = 0
+        limit = min(len(old_lines), len(new_lines))
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        if prefix == len(old_lines) == len(new_lines):
+            return self.canvas
+
+        suffix = 0
+        limit -= prefix
+        while suffix < limit and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+            suffix += 1
+
+        if prefix < len(self.header) or not self.blocks:
+            return self.compile(source)
+
+        # Blocks containing the first and last changed lines
+        block_starts = []
+        line = len(self.header)
+        for block in self.blocks:
+            block_starts.append(line)
+            line += len(block.lines)
+
+        first = bisect_right(block_starts, prefix) - 1
+        last = max(first, bisect_right(block_starts, len(old_lines) - suffix - 1) - 1)
+        shift = len(new_lines) - len(old_lines)
+
+        while True:
+            start = block_starts[first]
+            end = block_starts[last] + len(self.blocks[last].lines) + shift
+            try:
+                blocks = self._compile_region(new_lines[start:end])
+            except ParsingError:
+                # Compile everything to report the error with its position in the file
+                return self.compile(source)
+
+            if blocks is not None:
+                break
+            if first == 0:
+                return self.compile(source)
+
+            # The region doesn't start at a top-level block anymore, include the previous block
+            first -= 1
+
+        # Lines before the first block of the region belong to the block before it
+        leading_lines, blocks = blocks
+        if leading_lines:
+            if first == 0:
+                self.header = self.header + leading_lines
+            else:
+                previous = self.blocks[first - 1]
+                self.blocks[first - 1] = Block(previous.lines + leading_lines, previous.node, previous.layer)
+
+        self.blocks[first:last + 1] = blocks
+        self.lines = new_lines
+
+        # New Canvas node and layer around the (mostly) reused blocks
+        canvas_node = get_canvas_node(self.ast)
+        new_canvas_node = LayerNode(canvas_node.name, canvas_node.position)
+        new_canvas_node.params = canvas_node.params
+        new_canvas_node.named_params = canvas_node.named_params
+        new_canvas_node.exports = canvas_node.exports
+        new_canvas_node.children = [block.node for block in self.blocks]
+        self.ast = [new_canvas_node]
+
+        self.canvas = create_layer(new_canvas_node)
+        self.canvas.children = [block.layer for block in self.blocks]
+        return self.canvas
+
+    def _compile_region(self, lines: List[str]):
+        '''
+        Lexes and parses lines that should hold zero or more complete top-level blocks.
+        Returns the lines before the first block and the blocks, or None if the lines don't start at a block boundary.
+        '''
+
+        buffer = lex(''.join(lines))
+        starts = block_start_lines(buffer)
+
+        token_stream = TokenStream(buffer)
+        if not token_stream.hasnext():
+            return lines, [] # Only comments and blank lines
+        if not starts or buffer.position(0)[0] - 1 != starts[0]:
+            return None
+
+        expect(token_stream, 'INDENT')
+        nodes = parse_children(token_stream)
+        expect(token_stream, 'DEDENT')
+        if token_stream.hasnext():
+            raise ParsingError(f'Unexpected {token_stream.peek().type}')
+
+        ends = starts[1:] + [len(lines)]
+        blocks = [Block(lines[start:end], node, parse_ast(node, subcall=True))
+                  for start, end, node in zip(starts, ends, nodes)]
+        for block in blocks:
+            analyze_layers(block.layer) # Like the children of the Canvas, which exports nothing
+
+        return lines[:starts[0]], blocks
@@ -1,39 +1,268 @@
-import xml
-import xml.etree
-import xml.etree.ElementTree
-from syntax_tree import Node
+from typing import List
+from syntax_tree import CallNode, LayerNode
+from diagnostics import Diagnostic, SEMANTIC
+from display_list import DisplayList, RECT, CIRCLE, LINE, TEXT, IDENTITY, multiply, rotation, translation
+from expressions import BASE_SCOPE, BUILTINS, Template, compile_value, evaluate, evaluate_instances, fold_value, value_functions, value_names
 import re
-from math import sin, cos, tan, atan, asin, acos, pi, e
+import copy
+import math
+import bisect
+from collections import OrderedDict
+from math import pi
+
+try:
+    import numpy
+except ImportError: # Optional, animated layers then compute their values frame by frame
+    numpy = None
     
 class SemanticError(Exception):
-    pass
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.message = message
+        self.position = position
 
 def semanticAssert(condition, message):
     if not condition:
         raise SemanticError(message)
     
 class Context:
+    '''
+    What a layer renders its children with. The scope of expression names (see expressions.Scope) is persistent,
+    so copies share it, and layers exporting names give their copy a child scope with just those names.
+    '''
+    
+    __slots__ = ('fill_color', 'stroke_color', 'stroke_width', 'frame', 'scope')
+    
     def __init__(self):
         self.fill_color = None
         self.stroke_color = None
         self.stroke_width = 1
         self.frame = 0
-        self.globals = {'sin': sin, 'cos': cos, 'tan': tan, 'atan': atan, 'asin': asin, 'acos': acos, 'pi': pi, 'e': e}
+        self.scope = BASE_SCOPE
         
     def copy(self):
-        copy = Context()
+        copy = Context.__new__(Context)
         copy.fill_color = self.fill_color
         copy.stroke_color = self.stroke_color
         copy.stroke_width = self.stroke_width
         copy.frame = self.frame
-        copy.globals = self.globals.copy()
+        copy.scope = self.scope
         return copy
     
+    def style(self) -> tuple:
+        '''
+        The style draw commands are drawn with, see display_list.DisplayList
+        '''
+        
+        return (self.fill_color, self.stroke_color, self.stroke_width)
+    
+
+def expression_param(value, compiler=compile_value):
+    '''
+    Compiles a parameter that may hold an expression (see expressions.compile_value), reporting invalid ones
+    '''
+    
+    try:
+        return compiler(value)
+    except SyntaxError as e:
+        raise SemanticError(f'Invalid expression {value!r}: {e.msg}')
+
+# SVG lengths with a unit, like '50%' or '2em', which no expression spells
+SVG_LENGTH = re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?(%|px|em|ex|pt|pc|cm|mm|in)\s*')
+
+def length_param(value):
+    '''
+    Like expression_param, but SVG lengths with a unit (like '50%') are kept as is and written to the SVG unchanged
+    '''
+    
+    if isinstance(value, str) and SVG_LENGTH.fullmatch(value):
+        return value.strip()
+    return expression_param(value)
+
+RENDER_CACHE_SIZE = 8 # Renders kept per animated layer
+MAX_CACHE_KEY_LAYERS = 32 # Animated layers in a subtree above which its renders aren't cached
 
 class Layer:
-    def to_svg(self) -> xml.etree.ElementTree:
+    position = None # Set by create_layer: the position of the layer in the source, for errors found by later passes
+    
+    # Set by analyze_layers
+    scope_names = None # Names exported by the ancestors of the layer
+    dependencies = frozenset() # Names exported by the ancestors that the layer or its descendants read
+    time_dependent = False # Whether the subtree changes from frame to frame, without counting dependencies
+    
+    static = False # Set by mark_static_layers: the layer draws the same commands in every frame
+    
+    # Rendering state, never pickled with the layer tree
+    _static_commands = None # The display list of a static layer, rendered the first time it is needed
+    _dynamic_names = frozenset() # Set by mark_static_layers: names that change from frame to frame in the layer's scope
+    _render_cache = None # Set by attach_render_caches: recent renders of an animated layer, by cache key
+    _timed_layers = None # Set by attach_render_caches: the animated layers of the subtree, whose times are in the cache key
+    _timeline = None # Set by precompute_timelines: the values of an animated layer for every frame
+    
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        '''
+        Adds the draw commands of the layer and its children for the frame of the context to commands,
+        drawn with transform (see display_list).
+        Layers with children are generators rendering them with render_children, which yields the renders that
+        have children of their own to draw: render runs those before resuming the layer, from a loop rather than by
+        recursion, so the depth of the layer tree isn't limited by Python's recursion limit.
+        '''
+        
+        raise NotImplementedError()
+    
+    def render(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        '''
+        Like draw, but static layers are drawn once, and animated layers with a render cache are only drawn again when
+        the effective time of an animated layer of their subtree or the context they read changes (for example,
+        never after the end of their animation). Those are drawn into display lists of their own, without transform,
+        which are added to commands with it.
+        '''
+        
+        steps = self._start_render(ctx, commands, transform)
+        if steps is None:
+            return
+        
+        # The renders in progress, innermost last
+        stack = [steps]
+        while stack:
+            steps = next(stack[-1], None)
+            if steps is None:
+                stack.pop()
+            else:
+                stack.append(steps)
+    
+    def _start_render(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        # Renders the layer like render when that doesn't take drawing children, otherwise returns the render
+        # in progress, a generator to run like render does (see draw)
+        if self.static:
+            if self._static_commands is None:
+                return self._draw_static(ctx, commands, transform)
+            commands.extend(self._static_commands, transform)
+            return None
+        
+        cache = self._render_cache
+        if cache is None:
+            return self.draw(ctx, commands, transform)
+        
+        # Equal values of different types, like 0 and 0.0, are written differently, so their types are in the key too
+        frame = ctx.frame
+        values = [layer.effective_time(frame) for layer in self._timed_layers] + \
+                 [ctx.scope[name] for name in self._dynamic_names]
+        key = (tuple(values), tuple([type(value) for value in values]),
+               ctx.fill_color, ctx.stroke_color, ctx.stroke_width)
+        rendered = cache.get(key)
+        if rendered is None:
+            return self._draw_cached(key, ctx, commands, transform)
+        cache.move_to_end(key)
+        commands.extend(rendered, transform)
+        return None
+    
+    def _draw_static(self, ctx: Context, commands: DisplayList, transform: tuple):
+        static_commands = DisplayList()
+        steps = self.draw(ctx, static_commands)
+        if steps is not None:
+            yield from steps
+        self._static_commands = static_commands
+        commands.extend(static_commands, transform)
+    
+    def _draw_cached(self, key: tuple, ctx: Context, commands: DisplayList, transform: tuple):
+        rendered = DisplayList()
+        steps = self.draw(ctx, rendered)
+        if steps is not None:
+            yield from steps
+        cache = self._render_cache
+        cache[key] = rendered
+        if len(cache) > RENDER_CACHE_SIZE:
+            cache.popitem(last=False)
+        commands.extend(rendered, transform)
+    
+    def effective_time(self, frame: int):
+        '''
+        For animated layers, the animation progress t (between 0 and 1) at the given frame. None for other layers.
+        '''
+        
+        return None
+    
+    def animation_values(self, t, functions=math) -> tuple:
+        '''
+        For animated layers, the values the layer renders with at animation progress t, like its angle for Rotate.
+        t may also be a NumPy array of progresses, with the numpy module as functions, to get arrays of values.
+        '''
+        
         raise NotImplementedError()
     
+    def frame_values(self, frame: int) -> tuple:
+        '''
+        The animation values of the layer at the given frame, read from its timeline if it has one
+        '''
+        
+        timeline = self._timeline
+        if timeline is not None and 0 <= frame < len(timeline.rows):
+            return timeline.rows[frame]
+        return self.animation_values(self.effective_time(frame))
+    
+    def read_names(self) -> frozenset:
+        '''
+        Names the expressions of the layer's own parameters read
+        '''
+        
+        return frozenset()
+    
+    def called_names(self) -> frozenset:
+        '''
+        Names the expressions of the layer's own parameters call as functions
+        '''
+        
+        return frozenset()
+    
+    def fold_constants(self, constants: frozenset):
+        '''
+        Compiles the expressions of the layer's own parameters again with the builtins named in constants
+        folded, see expressions.fold_value
+        '''
+        
+        pass
+    
+    def frame_dependent(self, dynamic_names: frozenset) -> bool:
+        '''
+        Whether the layer's own attributes change from frame to frame (not counting its children),
+        given the names in scope that do
+        '''
+        
+        return not dynamic_names.isdisjoint(self.read_names())
+    
+    def dynamic_exports(self) -> frozenset:
+        '''
+        Names the layer sets in the scope of its children that change from frame to frame
+        '''
+        
+        return frozenset()
+    
+    def instance_exports(self) -> frozenset:
+        '''
+        Names the layer sets in the scope of its children that change from one instance of them to the next
+        within a render, like the index of Repeat
+        '''
+        
+        return frozenset()
+    
+    def __getstate__(self):
+        # Rendered display lists are never pickled with the layer tree
+        state = self.__dict__.copy()
+        for name in ('_static_commands', '_dynamic_names', '_render_cache', '_timed_layers', '_timeline'):
+            state.pop(name, None)
+        return state
+    
+def render_children(children: List[Layer], ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+    '''
+    Renders the children of a layer from its draw, yielding the renders in progress (see Layer.draw)
+    '''
+    
+    for child in children:
+        steps = child._start_render(ctx, commands, transform)
+        if steps is not None:
+            yield steps
+    
 class Canvas(Layer):
     def __init__(self, width, height, length=1):
         self.width = width
@@ -41,36 +270,27 @@ class Canvas(Layer):
         self.length = length
         self.children = []
         
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
-        svg = xml.etree.ElementTree.Element('svg', xmlns='http://www.w3.org/2000/svg', version='1.1',
-                                            width=str(self.width), height=str(self.height))
-        
-        for child in self.children:
-            svg.append(child.to_svg(ctx))
-        
-        return svg
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        yield from render_children(self.children, ctx, commands, transform)
     
 def get_color(node):
-    if type(node) is str:
-        return node
+    if isinstance(node, str):
+        return str(node)
 
-    semanticAssert(node.name == 'Solid', 'Only solid colors are supported')
-    return node.children[0].children[0].name.strip('\'"')
+    semanticAssert(isinstance(node, CallNode) and node.name == 'Solid', 'Only solid colors are supported')
+    semanticAssert(len(node.params) == 1 and isinstance(node.params[0], str), 'Solid takes a color name')
+    return str(node.params[0])
     
 class Fill(Layer):
     def __init__(self, color):
         self.color = get_color(color)
         self.children = []
         
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
         ctx_copy = ctx.copy()
         ctx_copy.fill_color = self.color
         
-        g = xml.etree.ElementTree.Element('g')
-        for child in self.children:
-            g.append(child.to_svg(ctx_copy))
-            
-        return g
+        yield from render_children(self.children, ctx_copy, commands, transform)
             
 class Stroke(Layer):
     def __init__(self, color=None, width=None):
@@ -78,7 +298,7 @@ class Stroke(Layer):
         self.width = width
         self.children = []
         
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
         ctx_copy = ctx.copy()
         if self.color is not None:
             ctx_copy.stroke_color = self.color
@@ -86,217 +306,423 @@ class Stroke(Layer):
         if self.width is not None:
             ctx_copy.stroke_width = self.width
         
-        g = xml.etree.ElementTree.Element('g')
-        for child in self.children:
-            g.append(child.to_svg(ctx_copy))
-            
-        return g
+        yield from render_children(self.children, ctx_copy, commands, transform)
+    
+def animation_window(start=None, end=None, length=None) -> tuple:
+    '''
+    Checks the temporal parameters of an animated layer, start (0 by default) with end or length, or end with
+    length, and returns its (start, length) in frames
+    '''
+    
+    if end is not None and length is not None:
+        semanticAssert(start is None, 'Cannot specify both start/end and length')
+        start = end - length + 1
+    elif end is not None:
+        start = 0 if start is None else start
+        length = end - start + 1
+    elif length is not None:
+        start = 0 if start is None else start
+    else:
+        raise SemanticError('Missing temporal parameters')
+    
+    semanticAssert(length > 1, 'Length must be over 1')
+    return start, length
+
+class AnimatedLayer(Layer):
+    '''
+    A layer animated from frame start over length frames. Layers that are only animated when given temporal
+    parameters leave start as None otherwise.
+    '''
     
-class Translate(Layer):
+    start = None
+    length = None
+    
+    def effective_time(self, frame: int):
+        if self.start is None:
+            return None
+        return max(0, min(1, (frame - self.start) / (self.length - 1)))
+    
+class Translate(AnimatedLayer):
     def __init__(self, x, y, start=None, end=None, length=None):
         self.x = x
         self.y = y
         self.children = []
         
-        if start is None and end is None and length is None:
-            self.start = None
-            self.length = None
-            self.animated = False
-        else:
-            self.animated = True
-
-            if start is None:
-                start = 0
-
-            if start is not None and end is not None:
-                semanticAssert(length is None, 'Cannot specify both start/end and length')
-                self.start = start
-                self.length = end - start + 1
-                
-            elif start is not None and length is not None:
-                self.start = start
-                self.length = length
-                
-            elif end is not None and length is not None:
-                self.length = length
-                self.start = end - length + 1
-                
-            else:
-                raise SemanticError('Missing temporal parameters')
-            
-            if length <= 1:
-                raise SemanticError('Length must be over 1')
-        
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
+        self.animated = not (start is None and end is None and length is None)
         if self.animated:
-            t = max(0, min(1, (ctx.frame - self.start) / (self.length - 1)))
-            x = self.x * t
-            y = self.y * t
-            g = xml.etree.ElementTree.Element('g', transform=f'translate({x}, {y})')
-        else:
-            g = xml.etree.ElementTree.Element('g', transform=f'translate({self.x}, {self.y})')
-            
-        for child in self.children:
-            g.append(child.to_svg(ctx))
-            
-        return g
+            self.start, self.length = animation_window(start, end, length)
+        
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        x, y = self.frame_values(ctx.frame) if self.animated else (self.x, self.y)
+        transform = multiply(transform, translation(x, y))
+        yield from render_children(self.children, ctx, commands, transform)
     
-class Rotate(Layer):
+    def animation_values(self, t, functions=math) -> tuple:
+        return (self.x * t, self.y * t)
+    
+    def frame_dependent(self, dynamic_names: frozenset) -> bool:
+        return self.animated
+    
+class Rotate(AnimatedLayer):
     def __init__(self, center, angle, start=None, end=None, length=None):
         self.center = center
         self.angle = angle
         self.children = []
         
-        if start is None and end is None and length is None:
-            self.start = None
-            self.length = None
-            self.animated = False
-        else:
-            self.animated = True
-
-            if start is None:
-                start = 0
-
-            if start is not None and end is not None:
-                semanticAssert(length is None, 'Cannot specify both start/end and length')
-                self.start = start
-                self.length = end - start + 1
-                
-            elif start is not None and length is not None:
-                self.start = start
-                self.length = length
-                
-            elif end is not None and length is not None:
-                self.length = length
-                self.start = end - length + 1
-                
-            else:
-                raise SemanticError('Missing temporal parameters')
-        
-            if length <= 1:
-                raise SemanticError('Length must be over 1')
-            
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
+        self.animated = not (start is None and end is None and length is None)
         if self.animated:
-            t = max(0, min(1, (ctx.frame - self.start) / (self.length - 1)))
-            angle = self.angle * t
-            g = xml.etree.ElementTree.Element('g', transform=f'rotate({angle}, {self.center[0]}, {self.center[1]})')
-        else:
-            g = xml.etree.ElementTree.Element('g', transform=f'rotate({self.angle}, {self.center[0]}, {self.center[1]})')
-            
-        for child in self.children:
-            g.append(child.to_svg(ctx))
+            self.start, self.length = animation_window(start, end, length)
             
-        return g
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        angle, = self.frame_values(ctx.frame) if self.animated else (self.angle,)
+        transform = multiply(transform, rotation(angle, self.center[0], self.center[1]))
+        yield from render_children(self.children, ctx, commands, transform)
+    
+    def animation_values(self, t, functions=math) -> tuple:
+        return (self.angle * t,)
     
-class CircularPath(Layer):
-    def __init__(self, center, r, start_angle=0, end_angle=360, start=0, end=None, length=None, _exports=None):
+    def frame_dependent(self, dynamic_names: frozenset) -> bool:
+        return self.animated
+    
+class CircularPath(AnimatedLayer):
+    def __init__(self, center, r, start_angle=0, end_angle=360, start=None, end=None, length=None, _exports=None):
         self.center = center
         self.r = r
         self.start_angle = start_angle
         self.end_angle = end_angle
         self.children = []
         self.exports = _exports or []
+        self.start, self.length = animation_window(start, end, length)
         
-        if start is not None and end is not None:
-            semanticAssert(length is None, 'Cannot specify both start/end and length')
-            self.start = start
-            self.length = end - start + 1
-            
-        elif start is not None and length is not None:
-            self.start = start
-            self.length = length
-            
-        elif end is not None and length is not None:
-            self.length = length
-            self.start = end - length + 1
-            
-        else:
-            raise SemanticError('Missing temporal parameters')
-    
-        if length <= 1:
-            raise SemanticError('Length must be over 1')
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        available_exports = self.frame_values(ctx.frame)
+
+        ctx_copy = ctx.copy()
+        if self.exports is not None:
+            ctx_copy.scope = ctx.scope.child(dict(zip(self.exports, available_exports)))
         
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
-        t = max(0, min(1, (ctx.frame - self.start) / (self.length - 1)))
+        yield from render_children(self.children, ctx_copy, commands, transform)
+    
+    def animation_values(self, t, functions=math) -> tuple:
+        # Values in the order of the exports: x, y, t, angle
         angle = self.start_angle + (self.end_angle - self.start_angle) * t
-        x = self.center[0] + self.r * cos(angle * pi / 180)
-        y = self.center[1] + self.r * sin(angle * pi / 180)
+        x = self.center[0] + self.r * functions.cos(angle * pi / 180)
+        y = self.center[1] + self.r * functions.sin(angle * pi / 180)
+        return (x, y, t, angle)
+    
+    def frame_dependent(self, dynamic_names: frozenset) -> bool:
+        return True
+    
+    def dynamic_exports(self) -> frozenset:
+        return frozenset(self.exports)
+
+def _ease_linear(u):
+    return u
+
+def _ease_in(u):
+    return u * u
+
+def _ease_out(u):
+    return u * (2 - u)
+
+def _ease_in_out(u):
+    return u * u * (3 - 2 * u)
+
+def _ease_step(u):
+    return u * 0 # Holds the value of the key until the next one, as a float like the other easings
+
+# Easing functions of Animate, from the progress u between two keyframes to the progress of the value.
+# They work on numbers and on NumPy arrays.
+EASINGS = {
+    'linear': _ease_linear,
+    'ease-in': _ease_in,
+    'ease-out': _ease_out,
+    'ease-in-out': _ease_in_out,
+    'step': _ease_step,
+}
+
+MAX_SEGMENT_TABLE = 1 << 16 # Longest animation, in frames, whose keyframes get a segment lookup table
+
+class Keyframes:
+    '''
+    The keyframes of an animated property, with everything finding its value at an animation progress t needs
+    computed once: the progress of each key, and the difference and progress span between consecutive keys.
+    table[f] is the segment (the index of the key it starts at) of the frame f frames after the first key, which
+    makes finding the value of a frame O(1). Other progresses, and the frames of long animations, which don't get
+    a table, bisect the key progresses.
+    '''
+
+    __slots__ = ('positions', 'values', 'deltas', 'spans', 'easing', 'last', 'table')
+
+    def __init__(self, offsets: list, values: list, easing):
+        # offsets are the frames of the keys from the first one, which is 0
+        self.last = offsets[-1]
+        self.positions = [offset / self.last for offset in offsets] # See effective_time
+        self.values = values
+        self.deltas = [b - a for a, b in zip(values, values[1:])]
+        self.spans = [b - a for a, b in zip(self.positions, self.positions[1:])]
+        self.easing = easing
+
+        self.table = None
+        if self.last < MAX_SEGMENT_TABLE:
+            self.table = []
+            for segment in range(len(offsets) - 1):
+                self.table.extend([segment] * (offsets[segment + 1] - offsets[segment]))
+            self.table.append(len(offsets) - 2)
+
+    def value(self, t):
+        if t <= 0:
+            return self.values[0]
+        if t >= 1:
+            return self.values[-1]
+
+        segment = min(bisect.bisect_right(self.positions, t), len(self.values) - 1) - 1
+        u = (t - self.positions[segment]) / self.spans[segment]
+        return self.values[segment] + self.deltas[segment] * self.easing(u)
+
+    def frame_value(self, offset: int):
+        # value at the frame offset frames after the first key, with the same progress as effective_time
+        if offset <= 0:
+            return self.values[0]
+        if offset >= self.last:
+            return self.values[-1]
+        if self.table is None:
+            return self.value(offset / self.last)
 
+        segment = self.table[offset]
+        u = (offset / self.last - self.positions[segment]) / self.spans[segment]
+        return self.values[segment] + self.deltas[segment] * self.easing(u)
+
+    def array_values(self, t):
+        # value for a NumPy array of progresses
+        segments = numpy.clip(numpy.searchsorted(self.positions, t, side='right') - 1, 0, len(self.values) - 2)
+        positions = numpy.asarray(self.positions)[segments]
+        u = (t - positions) / numpy.asarray(self.spans)[segments]
+        values = numpy.asarray(self.values, dtype=float)
+        eased = values[segments] + numpy.asarray(self.deltas, dtype=float)[segments] * self.easing(u)
+        return numpy.where(t <= 0, values[0], numpy.where(t >= 1, values[-1], eased))
+
+def keyframe_values(name: str, value) -> list:
+    '''
+    The values of the keyframes of a property of Animate: a tuple of integers, or a string of comma-separated
+    expressions that only use constants, like '-pi, 0, pi / 2'
+    '''
+
+    if isinstance(value, str):
+        parts = []
+        depth = 0
+        part_start = 0
+        for i, char in enumerate(value):
+            depth += (char == '(') - (char == ')')
+            if char == ',' and depth == 0:
+                parts.append(value[part_start:i])
+                part_start = i + 1
+        parts.append(value[part_start:])
+
+        value = []
+        for part in parts:
+            expression = expression_param(part)
+            semanticAssert(value_names(expression) <= BUILTINS.keys(), f'Keyframes of {name} can only use constants')
+            value.append(evaluate(expression, BUILTINS))
+    elif isinstance(value, int):
+        value = [value]
+
+    semanticAssert(isinstance(value, (tuple, list)) and all(isinstance(v, (int, float)) for v in value),
+                   f'Invalid keyframes for {name}')
+    semanticAssert(len(value) >= 2, f'{name} needs at least 2 keyframes')
+    return list(value)
+
+class Animate(AnimatedLayer):
+    '''
+    Animates any number of properties through keyframes, exporting their values to its children under the
+    property names, or the names of the exports in the order of the properties.
+    The keyframes are evenly spaced over the animation, or at the frames of keys, shared by all the properties.
+    Values between keyframes follow the easing.
+    '''
+
+    def __init__(self, start=None, end=None, length=None, keys=None, easing='linear', _exports=None, **properties):
+        semanticAssert(len(properties) > 0, 'Animate needs at least one property')
+        semanticAssert(easing in EASINGS, f'Unknown easing: {easing}')
+        self.properties = {name: keyframe_values(name, value) for name, value in properties.items()}
+        self.children = []
+
+        exports = _exports or []
+        semanticAssert(len(exports) <= len(self.properties), 'Animate exports more names than it has properties')
+        self.exports = list(exports) + list(self.properties)[len(exports):]
+
+        counts = {len(values) for values in self.properties.values()}
+        semanticAssert(len(counts) == 1, 'All the properties of Animate need the same number of keyframes')
+        count = counts.pop()
+
+        if keys is not None:
+            semanticAssert(start is None and end is None and length is None,
+                           'Cannot specify both keys and start/end/length')
+            keys = list(keys) if isinstance(keys, tuple) else [keys]
+            semanticAssert(all(isinstance(key, int) for key in keys), 'Keys must be frames')
+            semanticAssert(len(keys) == count, f'Animate has {count} keyframes but {len(keys)} keys')
+            semanticAssert(all(a < b for a, b in zip(keys, keys[1:])), 'Keys must be increasing')
+            self.start, self.length = animation_window(keys[0], keys[-1])
+            offsets = [key - keys[0] for key in keys]
+        else:
+            self.start, self.length = animation_window(start, end, length)
+            semanticAssert(count <= self.length, f'Animate has {count} keyframes but only {self.length} frames')
+            offsets = [k * (self.length - 1) // (count - 1) for k in range(count)]
+
+        self.tracks = [Keyframes(offsets, values, EASINGS[easing]) for values in self.properties.values()]
+
+    def frame_values(self, frame: int) -> tuple:
+        timeline = self._timeline
+        if timeline is not None and 0 <= frame < len(timeline.rows):
+            return timeline.rows[frame]
+        offset = frame - self.start
+        return tuple([track.frame_value(offset) for track in self.tracks])
+
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
         ctx_copy = ctx.copy()
-        available_exports = (x, y, t, angle)
+        ctx_copy.scope = ctx.scope.child(dict(zip(self.exports, self.frame_values(ctx.frame))))
 
-        if self.exports is not None:
-            for i, export in enumerate(self.exports):
-                ctx_copy.globals[export] = available_exports[i]
-        
-        g = xml.etree.ElementTree.Element('g')
-        for child in self.children:
-            g.append(child.to_svg(ctx_copy))
+        yield from render_children(self.children, ctx_copy, commands, transform)
+
+    def animation_values(self, t, functions=math) -> tuple:
+        # Values in the order of the properties
+        if functions is math:
+            return tuple([track.value(t) for track in self.tracks])
+        return tuple([track.array_values(t) for track in self.tracks])
+
+    def dynamic_exports(self) -> frozenset:
+        return frozenset(self.exports)
+
+class Repeat(Layer):
+    '''
+    Renders its children count times, exporting the index of the instance (0 to count - 1) and offsetting
+    each instance by (x, y), expressions that can read the index.
+    If the children don't read the index, they are rendered once as a template in <defs>, which the instances <use>.
+    '''
+
+    def __init__(self, count, x=0, y=0, _exports=None):
+        semanticAssert(isinstance(count, int) and count >= 0, 'Count must be a non-negative integer')
+        self.count = count
+        self.x = expression_param(x)
+        self.y = expression_param(y)
+        self.children = []
+        self.exports = _exports or []
+        semanticAssert(len(self.exports) <= 1, 'Repeat only exports the index of the instance')
+
+    def read_names(self) -> frozenset:
+        return (value_names(self.x) | value_names(self.y)) - self.instance_exports()
+
+    def called_names(self) -> frozenset:
+        return value_functions(self.x) | value_functions(self.y)
+
+    def fold_constants(self, constants: frozenset):
+        # The offsets can read the index, which may shadow a builtin
+        constants = constants - self.instance_exports()
+        self.x = fold_value(self.x, constants)
+        self.y = fold_value(self.y, constants)
+
+    def instance_exports(self) -> frozenset:
+        return frozenset(self.exports)
+
+    def children_read_index(self) -> bool:
+        '''
+        Whether any layer of the subtree reads the index (see analyze_layers)
+        '''
+
+        return any(self.exports[0] in child.dependencies for child in self.children) if self.exports else False
+
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        # Offsets of all the instances, evaluated at once
+        scope = ctx.scope.flat()
+        index = self.exports[0] if self.exports else None
+        xs = evaluate_instances(self.x, scope, index, self.count)
+        ys = evaluate_instances(self.y, scope, index, self.count)
+
+        if self.count == 0:
+            return
+
+        if not self.children_read_index():
+            template = DisplayList()
+            yield from render_children(self.children, ctx, template, IDENTITY)
+
+            template_id = commands.define(template, 'repeat')
+            for x, y in zip(xs, ys):
+                commands.use(template_id, multiply(transform, translation(x, y)))
+            return
+
+        offset = not (self.x == 0 and self.y == 0)
+        for i, x, y in zip(range(self.count), xs, ys):
+            instance_ctx = ctx.copy()
+            instance_ctx.scope = ctx.scope.child({index: i})
+            instance_transform = multiply(transform, translation(x, y)) if offset else transform
+            yield from render_children(self.children, instance_ctx, commands, instance_transform)
 
-        return g
-            
-        
-    
 class Rectangle(Layer):
     def __init__(self, x, y, width, height):
         super().__init__()
-        self.x = x
-        self.y = y
-        self.width = width
-        self.height = height
+        self.x = length_param(x)
+        self.y = length_param(y)
+        self.width = length_param(width)
+        self.height = length_param(height)
         
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
-        rect = xml.etree.ElementTree.Element('rect', x=str(self.x), y=str(self.y), width=str(self.width), height=str(self.height))
-        
-        if ctx.fill_color is not None:
-            rect.set('fill', ctx.fill_color)
+    def read_names(self) -> frozenset:
+        return value_names(self.x) | value_names(self.y) | value_names(self.width) | value_names(self.height)
+    
+    def called_names(self) -> frozenset:
+        return value_functions(self.x) | value_functions(self.y) | value_functions(self.width) | \
+               value_functions(self.height)
+    
+    def fold_constants(self, constants: frozenset):
+        self.x = fold_value(self.x, constants)
+        self.y = fold_value(self.y, constants)
+        self.width = fold_value(self.width, constants)
+        self.height = fold_value(self.height, constants)
         
-        if ctx.stroke_color is not None:
-            rect.set('stroke', ctx.stroke_color)
-            rect.set('stroke-width', str(ctx.stroke_width))
-        return rect
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        scope = ctx.scope.flat()
+        commands.add(RECT, (evaluate(self.x, scope), evaluate(self.y, scope), evaluate(self.width, scope),
+                            evaluate(self.height, scope)), ctx.style(), transform)
     
 class Circle(Layer):
     def __init__(self, x, y, r):
         super().__init__()
-        self.x = x
-        self.y = y
-        self.r = r
-        
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
-        circle = xml.etree.ElementTree.Element('circle', cx=str(self.x), cy=str(self.y), r=str(self.r))
+        self.x = length_param(x)
+        self.y = length_param(y)
+        self.r = length_param(r)
         
-        if ctx.fill_color is not None:
-            circle.set('fill', ctx.fill_color)
+    def read_names(self) -> frozenset:
+        return value_names(self.x) | value_names(self.y) | value_names(self.r)
+    
+    def called_names(self) -> frozenset:
+        return value_functions(self.x) | value_functions(self.y) | value_functions(self.r)
+    
+    def fold_constants(self, constants: frozenset):
+        self.x = fold_value(self.x, constants)
+        self.y = fold_value(self.y, constants)
+        self.r = fold_value(self.r, constants)
         
-        if ctx.stroke_color is not None:
-            circle.set('stroke', ctx.stroke_color)
-            circle.set('stroke-width', str(ctx.stroke_width))
-        return circle
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        scope = ctx.scope.flat()
+        commands.add(CIRCLE, (evaluate(self.x, scope), evaluate(self.y, scope), evaluate(self.r, scope)),
+                     ctx.style(), transform)
     
 class Arrow(Layer):
     def __init__(self, origin, vector):
         self.origin = origin
         self.vector = vector
 
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
-        line = xml.etree.ElementTree.Element('line', x1=str(self.origin[0]), y1=str(self.origin[1]), x2=str(self.origin[0] + self.vector[0]), y2=str(self.origin[1] + self.vector[1]))
-        
-        if ctx.stroke_color is not None:
-            line.set('stroke', ctx.stroke_color)
-            line.set('stroke-width', str(ctx.stroke_width))
-        
-        return line
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
+        commands.add(LINE, (self.origin[0], self.origin[1], self.origin[0] + self.vector[0], self.origin[1] + self.vector[1]),
+                     ctx.style(), transform)
 
 class Latex(Layer):
     def __init__(self, code, x, y, size=4):
         self.code = code
-        self.x = x
-        self.y = y
+        self.template = expression_param(self.expand_commands(), Template)
+        self.x = length_param(x)
+        self.y = length_param(y)
         self.size = size
 
-    def to_svg(self, ctx: Context) -> xml.etree.ElementTree:
+    def expand_commands(self) -> str:
         # Very primitive latex parsing while waiting for a better solution
         # Replace \textrm{A} and \textbf{A} with A
         processed_code = re.sub(r'\\textrm\{(.+?)\}', r'\1', self.code)
@@ -305,124 +731,382 @@ class Latex(Layer):
         # Replace \frac{A}{B} and \dfrac{A}{B} with A/B
         processed_code = re.sub(r'\\frac\{(.+?)\}\{(.+?)\}', r'\1/\2', processed_code)
         processed_code = re.sub(r'\\dfrac\{(.+?)\}\{(.+?)\}', r'\1/\2', processed_code)
+        return processed_code
+    
+    def read_names(self) -> frozenset:
+        return self.template.names | value_names(self.x) | value_names(self.y)
+    
+    def called_names(self) -> frozenset:
+        return self.template.functions | value_functions(self.x) | value_functions(self.y)
+    
+    def fold_constants(self, constants: frozenset):
+        self.template = Template(self.expand_commands(), constants)
+        self.x = fold_value(self.x, constants)
+        self.y = fold_value(self.y, constants)
 
+    def draw(self, ctx: Context, commands: DisplayList, transform: tuple = IDENTITY):
         # Replace \eval{A} with the evaluation
-        processed_code = re.sub(r'\\eval\{(.+?)\}', lambda m: str(eval(m.group(1), ctx.globals)), processed_code)
+        scope = ctx.scope.flat()
+        processed_code = self.template.render(scope)
+        x = evaluate(self.x, scope)
+        y = evaluate(self.y, scope)
 
-        if type(self.x) == str:
-            x = eval(self.x, ctx.globals)
-        else:
-            x = self.x
+        commands.add(TEXT, (x, y, processed_code, self.size), ctx.style(), transform)
+    
+def _analyze_layer(layer: Layer, scope_names: frozenset, diagnostics: List[Diagnostic] = None):
+    # Folds the builtins no ancestor shadows into the layer's expressions and checks the names they still read
+    layer.fold_constants(frozenset(BUILTINS.keys() - scope_names))
+    names = layer.read_names()
+    errors = [f'Unknown name: {name}' for name in sorted(names - scope_names - BUILTINS.keys())]
 
-        if type(self.y) == str:
-            y = eval(self.y, ctx.globals)
-        else:
-            y = self.y
-                    
+    # Exports are numbers, so only the builtin functions they don't shadow can be called
+    exports = scope_names | layer.instance_exports()
+    errors += [f'{name} is not a function' for name in sorted(layer.called_names())
+               if name in exports or (name in BUILTINS and not callable(BUILTINS[name]))]
+    for message in errors:
+        if diagnostics is None:
+            raise SemanticError(message, layer.position)
+        diagnostics.append(Diagnostic(SEMANTIC, message, layer.position))
+    
+    layer.scope_names = scope_names
+    layer.dependencies = names & scope_names
+    layer.time_dependent = layer.frame_dependent(frozenset())
 
-        text = xml.etree.ElementTree.Element('text', x=str(x), y=str(y))
-            
-        if ctx.fill_color is not None:
-            text.set('fill', ctx.fill_color)
-            
-        if ctx.stroke_color is not None:
-            text.set('stroke', ctx.stroke_color)
-            text.set('stroke-width', str(ctx.stroke_width))
+def analyze_layers(root: Layer, diagnostics: List[Diagnostic] = None, scope_names: frozenset = frozenset()):
+    '''
+    Semantic pass over the layer tree created by parse_ast. Resolves the free names of every expression: builtins
+    no ancestor exports are folded as constants (see expressions.fold_value), names exported by an ancestor are
+    dependencies, and any other name is an error, as are calls to anything but the builtin functions. Then annotates every layer with
+    - scope_names: the names its ancestors export,
+    - dependencies: those of them the layer or its descendants read,
+    - time_dependent: whether the layer or one of its descendants is animated, or reads a name exported by
+      an animated layer of the subtree. Names exported by ancestors are in dependencies instead.
+    Subtrees already analyzed with the same scope_names are skipped, like the blocks the incremental compiler reuses.
+    scope_names are the names exported around root, for subtrees checked on their own (see parse_ast).
+    Without diagnostics, the first error is raised.
+    '''
     
-        text.text = processed_code
-        text.set('font-size', str(self.size))
-        return text
+    if root.scope_names == scope_names:
+        return
     
-layer_classes = {c.__name__: c for c in [Canvas, Fill, Stroke, Translate, Rotate, CircularPath, Rectangle, Circle, Arrow, Latex]}
+    # Post-order traversal with an explicit stack of (layer, names its children's ancestors export, children left)
+    _analyze_layer(root, scope_names, diagnostics)
+    stack = [(root, scope_names | root.dynamic_exports() | root.instance_exports(), iter(getattr(root, 'children', [])))]
+    while stack:
+        layer, scope_names, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if stack:
+                # Reading a name that the parent changes from frame to frame makes the parent change too
+                parent = stack[-1][0]
+                parent.dependencies |= layer.dependencies - parent.dynamic_exports() - parent.instance_exports()
+                parent.time_dependent = parent.time_dependent or layer.time_dependent or \
+                                        not layer.dependencies.isdisjoint(parent.dynamic_exports())
+            continue
+        
+        if child.scope_names == scope_names:
+            stack.append((child, None, iter(())))
+            continue
+        _analyze_layer(child, scope_names, diagnostics)
+        stack.append((child, scope_names | child.dynamic_exports() | child.instance_exports(),
+                      iter(getattr(child, 'children', []))))
+
+# Layers that only change how their children are drawn, and draw nothing without them
+WRAPPERS = (Fill, Stroke, Translate, Rotate)
 
-def eval_node(node):
-    if node.name == 'Tuple':
-        return tuple([eval_node(child) for child in node.children])
+def _is_number(value) -> bool:
+    return type(value) in (int, float) and math.isfinite(value)
+
+def _is_identity(layer: Layer) -> bool:
+    # Wrappers drawing their children exactly as their parent would: multiply leaves transforms as they are when
+    # composing them with translations by 0 and rotations by 0 degrees, even animated ones
+    if type(layer) is Translate:
+        return _is_number(layer.x) and _is_number(layer.y) and layer.x == 0 and layer.y == 0
+    if type(layer) is Rotate:
+        return _is_number(layer.angle) and layer.angle == 0 and all(_is_number(value) for value in layer.center)
+    if type(layer) is Stroke:
+        return layer.color is None and layer.width is None
+    return False
+
+def _same(a, b) -> bool:
+    # Equal values of different types, like 2 and 2.0, are written differently
+    return a == b and type(a) is type(b)
+
+def _mergeable(first: Layer, second: Layer) -> bool:
+    # Whether two adjacent siblings draw their children the same way, so they can be one layer
+    if type(first) is not type(second):
+        return False
+    if type(first) is Fill:
+        return first.color == second.color
+    if type(first) is Stroke:
+        return first.color == second.color and _same(first.width, second.width)
+    if type(first) is Translate:
+        return not (first.animated or second.animated) and _same(first.x, second.x) and _same(first.y, second.y)
+    if type(first) is Rotate:
+        return not (first.animated or second.animated) and _same(first.angle, second.angle) and \
+               len(first.center) == len(second.center) and all(_same(a, b) for a, b in zip(first.center, second.center))
+    return False
+
+def _copy_layer(layer: Layer, children: List[Layer]) -> Layer:
+    # A copy of the layer with other children, analyzed again by analyze_layers
+    layer = copy.copy(layer)
+    layer.children = children
+    layer.scope_names = None
+    return layer
+
+def _append_layer(children: List[Layer], layer: Layer):
+    # Appends a layer to simplified children, merged into the last one if they are mergeable, and so on down the
+    # first children of the layer. Children are only ever added after the ones they were after.
+    merged_children = []
+    while children and _mergeable(children[-1], layer):
+        merged = _copy_layer(children[-1], list(children[-1].children))
+        children[-1] = merged
+        merged_children.append((merged.children, layer.children[1:]))
+        children, layer = merged.children, layer.children[0]
+    children.append(layer)
+    for children, rest in merged_children:
+        children.extend(rest)
+
+def simplify_layers(root: Layer) -> Layer:
+    '''
+    Rewrites the layer tree into one with fewer layers drawing exactly the same commands (see display_list):
+    - wrappers without children are removed,
+    - identity wrappers (translations by 0, rotations by 0 degrees and strokes without color and width) are
+      replaced by their children,
+    - adjacent Fill, Stroke, Translate or Rotate siblings drawing their children the same way are merged,
+    - a Fill whose only child is a Fill, or a Stroke whose only child is a Stroke, is merged into its child.
+    The tree itself is left as is, layers whose children change are copied, so the trees the incremental compiler
+    keeps stay valid. Copies have no scope_names, so analyze_layers analyzes them again.
+    '''
+
+    # Post-order traversal with an explicit stack of (layer, children left, simplified children)
+    stack = [(root, iter(getattr(root, 'children', [])), [])]
+    while stack:
+        child = next(stack[-1][1], None)
+        if child is not None:
+            stack.append((child, iter(getattr(child, 'children', [])), []))
+            continue
+
+        layer, _, children = stack.pop()
+        if hasattr(layer, 'children') and (len(children) != len(layer.children) or
+                                           any(a is not b for a, b in zip(children, layer.children))):
+            layer = _copy_layer(layer, children)
+        if not stack:
+            return layer
+
+        parent_children = stack[-1][2]
+        if isinstance(layer, WRAPPERS) and not layer.children:
+            continue
+        if _is_identity(layer):
+            for child in layer.children:
+                _append_layer(parent_children, child)
+            continue
+        if type(layer) in (Fill, Stroke) and len(layer.children) == 1 and type(layer.children[0]) is type(layer):
+            # The child's style overrides the layer's, where it has one
+            inner = layer.children[0]
+            if type(layer) is Stroke:
+                inner = _copy_layer(inner, inner.children)
+                inner.color = layer.color if inner.color is None else inner.color
+                inner.width = layer.width if inner.width is None else inner.width
+            layer = inner
+        _append_layer(parent_children, layer)
+
+def mark_static_layers(root: Layer):
+    '''
+    Frame-dependence analysis: sets static on every layer of the tree, True if neither the layer nor any of its
+    descendants changes from frame to frame. A layer changes if it is animated or reads a name exported by an
+    animated ancestor (like the coordinates exported by CircularPath).
+    Layers reading the index of a Repeat aren't static either, as each instance differs, but that doesn't make
+    the Repeat itself change from frame to frame.
+    The dependencies found by analyze_layers, which runs first if it hasn't yet, are what the render cache of
+    a layer is keyed by, so renders are shared by contexts that only differ in names the subtree doesn't read.
+    '''
     
-    # Integer
-    elif re.match(r'^\d+$', node.name):
-        return int(node.name)
+    analyze_layers(root)
+    stack = [root]
+    while stack:
+        layer = stack.pop()
+        layer.static = not (layer.time_dependent or layer.dependencies)
+        layer._static_commands = None
+        layer._dynamic_names = layer.dependencies
+        stack.extend(getattr(layer, 'children', []))
+
+def attach_render_caches(root: Layer):
+    '''
+    Gives every animated layer that isn't static (see mark_static_layers, which must run first) a bounded LRU cache
+    of its renders, keyed by the effective times of the animated layers of its subtree and the context it reads.
+    Subtrees with more than MAX_CACHE_KEY_LAYERS animated layers aren't cached, computing their key would cost
+    about as much as rendering them.
+    '''
     
-    # Float
-    elif re.match(r'^\d+\.\d+$', node.name):
-        return float(node.name)
+    # Post-order traversal with an explicit stack of [layer, children left, animated layers found so far]
+    # The list of animated layers is None once there are too many of them
+    stack = [[root, iter(getattr(root, 'children', [])), []]]
+    while stack:
+        entry = stack[-1]
+        child = next(entry[1], None)
+        if child is not None:
+            stack.append([child, iter(getattr(child, 'children', [])), []])
+            continue
+        
+        stack.pop()
+        layer, _, timed_layers = entry
+        animated = layer.effective_time(0) is not None
+        if timed_layers is not None and animated:
+            timed_layers.append(layer)
+            if len(timed_layers) > MAX_CACHE_KEY_LAYERS:
+                timed_layers = None
+        
+        cached = timed_layers is not None and animated and not layer.static
+        layer._timed_layers = timed_layers if cached else None
+        layer._render_cache = OrderedDict() if cached else None
+        
+        if stack:
+            parent = stack[-1]
+            if timed_layers is None or parent[2] is None:
+                parent[2] = None
+            else:
+                parent[2].extend(timed_layers)
+                if len(parent[2]) > MAX_CACHE_KEY_LAYERS:
+                    parent[2] = None
+
+class Timeline:
+    '''
+    The animation values of a layer for every frame of the canvas, computed at once by precompute_timelines.
+    columns holds a NumPy array over the frames for each value and exports the columns of the names the layer exports.
+    rows[frame] is the tuple of values of a frame, as Python numbers, which rendering indexes.
+    '''
+
+    __slots__ = ('columns', 'exports', 'rows')
+
+    def __init__(self, layer: Layer, length: int):
+        frames = numpy.arange(length)
+        progress = (frames - layer.start) / (layer.length - 1) # See effective_time
+        self.columns = layer.animation_values(numpy.clip(progress, 0, 1), numpy)
+        self.exports = dict(zip(getattr(layer, 'exports', None) or (), self.columns))
+
+        # Outside of the animation effective_time is the int 0 or 1, not a float, and values computed from it
+        # can be ints too, so those frames use the values of the scalar path to render exactly the same text
+        before = int(numpy.count_nonzero(progress <= 0))
+        after = int(numpy.count_nonzero(progress >= 1))
+        during = slice(before, length - after)
+        self.rows = [layer.animation_values(0)] * before + \
+                    list(zip(*[column[during].tolist() for column in self.columns])) + \
+                    [layer.animation_values(1)] * after
+
+def precompute_timelines(root: Layer, length: int):
+    '''
+    Computes the timeline of every animated layer of the tree for frames 0 to length - 1 with NumPy, so rendering
+    a frame just reads a row of precomputed values. Does nothing if NumPy isn't installed.
+    '''
+
+    if numpy is None:
+        return
+
+    stack = [root]
+    while stack:
+        layer = stack.pop()
+        layer._timeline = Timeline(layer, length) if layer.effective_time(0) is not None else None
+        stack.extend(getattr(layer, 'children', []))
+
+layer_classes = {c.__name__: c for c in [Canvas, Fill, Stroke, Translate, Rotate, CircularPath, Animate, Repeat, Rectangle, Circle, Arrow, Latex]}
+
+def get_canvas_node(nodes: List[LayerNode]) -> LayerNode:
+    '''
+    Returns the Canvas node of a parsed file, checking that it is the only top-level layer
+    '''
     
-    # Single quote string
-    elif re.match(r'^\'[^\']*\'$', node.name):
-        return node.name.strip('\'')
+    semanticAssert(len(nodes) > 0, 'Missing Canvas')
+    if len(nodes) > 1:
+        raise SemanticError('Multiple top-level layers', nodes[1].position)
     
-    # Double quote string
-    elif re.match(r'^\"[^\"]*\"$', node.name):
-        return node.name.strip('\"')
+    top_layer = nodes[0]
+    if top_layer.name != 'Canvas':
+        raise SemanticError('Top-level layer must be a Canvas', top_layer.position)
+    return top_layer
+
+def create_layer(root: LayerNode, subcall=False) -> Layer:
+    '''
+    Creates the layer for a node of the syntax tree, without its children
+    '''
     
-    else:
-        return node.name
-
-def get_layer_params(node):
-    parameters_node = None
-    for child in node.children:
-        if child.name == 'parameters':
-            parameters_node = child
-            break
-        
-    if parameters_node is None:
-        return {}
-    
-    named_parameters = {}
-    anonymous_parameters = []
-    for param_node in parameters_node.children:
-        param_type = param_node.name
-        if param_type == 'NamedParameter':
-            param_name = param_node.children[0].name
-            param_value = eval_node(param_node.children[1])
-            named_parameters[param_name] = param_value
-        else:
-            param_val_node = param_node.children[0]
-            anonymous_parameters.append(eval_node(param_val_node) if len(param_val_node.children) == 0 else param_val_node)
-            
-    return named_parameters, anonymous_parameters
+    try:
+        semanticAssert(root.name in layer_classes, f'Unknown layer type: {root.name}')
+        layer_class = layer_classes[root.name]
         
-def get_layer_children(node):
-    children_node = None
-    for child in node.children:
-        if child.name == 'children':
-            children_node = child
-            break
+        if subcall and layer_class == Canvas:
+            raise SemanticError('Canvas must be the top-level layer')
         
-    if children_node is None:
-        return []
-    
-    return children_node.children
+        named_parameters = root.named_params
+        if root.exports is not None:
+            named_parameters = dict(named_parameters, _exports=root.exports)
 
-def get_layer_exports(node):
-    exports_node = None
-    for child in node.children:
-        if child.name == 'exports':
-            exports_node = child
-            break
-        
-    if exports_node is None:
-        return None
+        try:
+            layer = layer_class(*root.params, **named_parameters)
+        except TypeError as e:
+            # Missing, unknown or mistyped parameters
+            raise SemanticError(f'Invalid parameters for {root.name}: {str(e).split("() ", 1)[-1]}')
+        layer.position = root.position
+        return layer
+    except SemanticError as e:
+        if e.position is None:
+            e.position = root.position
+        raise
+
+def parse_ast(root: LayerNode, subcall=False, diagnostics: List[Diagnostic] = None) -> Layer:        
+    '''
+    Creates the layer tree for a node of the syntax tree.
+    Layers are created in the same order as a recursive pre-order traversal, but with an explicit stack of
+    (layer, remaining child nodes), so nesting depth is only limited by memory.
+    Without diagnostics, the first semantic error is raised. Otherwise, semantic errors are added to diagnostics
+    and the invalid layers are left out of the tree, but their children are still checked, analyze_layers included:
+    they are analyzed on their own, with the names their ancestors and the invalid layer were meant to export.
+    Returns None if the root layer itself is invalid.
+    '''
     
-    return [child.name for child in exports_node.children]
+    root_layer = None
+    detached = [] # (layer left out of the tree, names exported around it)
+    stack = [(None, iter([root]), frozenset())] # (layer, remaining child nodes, names exported to its children)
+    while stack:
+        parent, children, scope_names = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            continue
+        
+        layer = None
+        try:
+            layer = create_layer(child, subcall=subcall or parent is not None)
+            if parent is not None:
+                if not hasattr(parent, 'children'):
+                    raise SemanticError(f'{type(parent).__name__} cannot have children', child.position)
+                parent.children.append(layer)
+        except SemanticError as e:
+            if diagnostics is None:
+                raise
+            diagnostics.append(Diagnostic(SEMANTIC, e.message, e.position))
+            if layer is None:
+                layer = _InvalidLayer(frozenset(child.exports or ()))
+            detached.append((layer, scope_names))
+        
+        if root_layer is None:
+            root_layer = layer
+        stack.append((layer, iter(child.children), scope_names | layer.dynamic_exports() | layer.instance_exports()))
     
+    for layer, scope_names in detached:
+        analyze_layers(layer, diagnostics, scope_names)
+    return None if isinstance(root_layer, _InvalidLayer) else root_layer
 
-def parse_ast(root: Node, subcall=False) -> Layer:        
-    semanticAssert(root.name in layer_classes, f'Unknown layer type: {root.name}')
-    layer_class = layer_classes[root.name]
+class _InvalidLayer(Layer):
+    '''
+    Stands in for a layer that couldn't be created, so that its children are still checked, reading the names
+    it was meant to export
+    '''
     
-    if subcall and layer_class == Canvas:
-        raise SemanticError('Canvas must be the top-level layer')
+    def __init__(self, exports: frozenset):
+        self.children = []
+        self.exports = exports
     
-    named_parameters, anonymous_parameters = get_layer_params(root)
-    children = get_layer_children(root)
-    exports = get_layer_exports(root)
-
-    if exports is not None:
-        named_parameters['_exports'] = exports
-
-    layer = layer_class(*anonymous_parameters, **named_parameters)
-    for child in children:
-        layer.children.append(parse_ast(child, subcall=True))
-        
-    return layer
\ No newline at end of file
+    def dynamic_exports(self) -> frozenset:
+        return self.exports
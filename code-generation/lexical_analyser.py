@@ -1,80 +1,395 @@
-from tokens import token_validators
+import sys
+import os
+import mmap
+from tokens import token_validators, token_type_codes, Token, TokenBuffer
+
+INDENT_CODE = token_type_codes['INDENT']
+NEWLINE_CODE = token_type_codes['NEWLINE']
+DEDENT_CODE = token_type_codes['DEDENT']
+
+# The lexer is a table-driven DFA compiled from the token definitions in tokens.py.
+# Every character is mapped to a small integer class, and every (state, class) pair
+# to a single table entry: the low byte is the next state, the high bits are actions.
+
+START = 0 # No token in progress
+
+# Actions (high bits of a table entry). An entry without actions just extends the token.
+EMIT = 1 # Emit the token in progress (not including the current character)
+BROKEN_ARROW = 2 # Drop the token in progress and report a broken arrow
+NEW_TOKEN = 4 # Start a new token at the current character
+INVALID = 8 # Report the current character as invalid
+COMMENT = 16 # Skip to the end of the line, keeping the token in progress
+EMIT_INCLUSIVE = 32 # Extend the token with the current character, then emit it
+NEWLINE = 64 # End the current line
+DECODE = 128 # Classify the multi-byte character starting at this byte before applying its transition
+
+# Actions when the input ends
+EOF_EMIT = 1
+EOF_UNTERMINATED = 2
+EOF_BROKEN_ARROW = 4
+
+def _state_key(token_type: str, content: str):
+    '''
+    Returns the key of the DFA state for a token of the given type and content.
+    Only the properties of the content that the validators look at are kept, which is what keeps the DFA finite.
+    '''
+
+    if token_type == 'INDENT':
+        return (token_type, content)
+    if token_type == 'LIT':
+        return (token_type, content[0], len(content) > 1, len(content) > 1 and content[-1] == content[0])
+    return (token_type,)
+
+def _start_type(c: str):
+    for typename, validator in token_validators.items():
+        if validator.is_valid_start(c):
+            return typename
+    return None
+
+class _LexerTables:
+    '''
+    Transition tables built by probing the token validators with sample characters and token contents
+    '''
+
+    def __init__(self):
+        self.state_types = [None] # Token type of each state
+        self.state_samples = [None] # Sample token content of each state
+        self.state_index = {}
+
+        # Discover all states reachable from the start characters
+        ascii_chars = [chr(i) for i in range(128) if chr(i) not in '\n#']
+        pending = []
+        for c in ascii_chars:
+            typename = _start_type(c)
+            if typename is not None:
+                pending.append((typename, c))
+
+        while pending:
+            typename, content = pending.pop()
+            if _state_key(typename, content) in self.state_index:
+                continue
+
+            self._add_state(typename, content)
+            validator = token_validators[typename]
+            for c in ascii_chars:
+                if validator.is_valid_content(c, content):
+                    pending.append((typename, content + c))
+
+        self.eof_actions = [self._eof_action(state) for state in range(len(self.state_types))]
+        self.state_codes = [token_type_codes.get(typename, 0) for typename in self.state_types]
+
+        # Group characters with identical columns into classes
+        self.transitions = [[] for _ in self.state_types]
+        self.class_columns = {}
+        self.char_classes = _CharClasses(self)
+        for i in range(128):
+            self.char_classes[i]
+
+    def _add_state(self, typename: str, content: str):
+        self.state_index[_state_key(typename, content)] = len(self.state_types)
+        self.state_types.append(typename)
+        self.state_samples.append(content)
+
+    def _eof_action(self, state: int) -> int:
+        typename = self.state_types[state]
+        content = self.state_samples[state]
+        if typename is None:
+            return 0
+        if typename == 'ARROW':
+            return EOF_BROKEN_ARROW
+        if typename == 'LIT' and content[-1] != content[0]:
+            return EOF_UNTERMINATED | EOF_EMIT
+        return EOF_EMIT
+
+    def _new_token(self, c: str) -> int:
+        typename = _start_type(c)
+        if typename is None:
+            return INVALID << 8 | START
+        return NEW_TOKEN << 8 | self.state_index[_state_key(typename, c)]
+
+    def _transition(self, state: int, c: str) -> int:
+        typename = self.state_types[state]
+        content = self.state_samples[state]
 
-def tokenize(string: str):    
-    in_comment = False
-    token_type = None
-    token_val = None
-    
-    index = 0
-    
-    while index < len(string):
-        c = string[index]
-        
         if c == '\n':
-            if in_comment:
-                in_comment = False
-            
-            if token_type == 'INDENT':
+            if typename is None or typename == 'INDENT':
                 # Ignore whitespace at the end of a line
-                token_type = None
-                token_val = None
-            elif token_type is not None: # Break token on newline
-                yield (f'<{token_type}, "{token_val}">')
-                token_type = None
-                token_val = None
-                
-            index += 1
-            continue
-
-        if in_comment:
-            index += 1
-            continue
-        
+                return NEWLINE << 8 | START
+            return (EMIT | NEWLINE) << 8 | START
+
         if c == '#':
-            in_comment = True
-            index += 1
-            continue
-        
-        if token_type is not None:
-            # Currently parsing token
-            
-            if token_validators[token_type].is_valid_content(c, token_val):
-                token_val += c
-                index += 1
-                if token_type == "ARROW":
-                    yield (f'<{token_type}, "{token_val}">')
-                    token_type = None
-                    token_val = None
-                    continue
-            elif token_type == "ARROW" and c != ">":
-                print(':: LEXICAL ERROR :: broken arrow')
-                token_type = None
-                token_val = None
-            elif token_type == "INDENT" and token_val != '\t' and len(token_val) != 4:
-                # Ignore this token, it's just whitespace, not indentation
-                token_type = None
-                token_val = None
-            else:
-                yield (f'<{token_type}, "{token_val}">')
-                token_type = None
-                token_val = None
+            return COMMENT << 8 | state
+
+        if typename is None:
+            return self._new_token(c)
+
+        if token_validators[typename].is_valid_content(c, content):
+            if typename == 'ARROW':
+                return EMIT_INCLUSIVE << 8 | START
+            return self.state_index[_state_key(typename, content + c)]
+        elif typename == 'ARROW' and c != '>':
+            return BROKEN_ARROW << 8 | self._new_token(c)
+        elif typename == 'INDENT' and content != '\t' and len(content) != 4:
+            # Drop this token, it's just whitespace, not indentation
+            return self._new_token(c)
+        else:
+            return EMIT << 8 | self._new_token(c)
+
+    def classify(self, c: str) -> int:
+        return self.class_for_column(tuple(self._transition(state, c) for state in range(len(self.state_types))))
+
+    def class_for_column(self, column) -> int:
+        char_class = self.class_columns.get(column)
+        if char_class is None:
+            char_class = len(self.class_columns)
+            self.class_columns[column] = char_class
+            for state, entry in enumerate(column):
+                self.transitions[state].append(entry)
+        return char_class
+
+class _CharClasses(dict):
+    '''
+    Maps code points to their character class (as a one-character string, for str.translate).
+    Characters are classified on first use, so non-ASCII input is handled too.
+    '''
+
+    def __init__(self, tables: _LexerTables):
+        super().__init__()
+        self.tables = tables
+
+    def __missing__(self, code_point: int) -> str:
+        char_class = chr(self.tables.classify(chr(code_point)))
+        self[code_point] = char_class
+        return char_class
+
+def _byte_classes(tables: _LexerTables) -> bytes:
+    '''
+    Builds the bytes.translate table used to lex UTF-8 input.
+    Continuation bytes never change the state, so a multi-byte character is decided by its first byte:
+    directly if all non-ASCII characters behave the same in a state (like inside a literal), with DECODE otherwise.
+    '''
+
+    states = range(len(tables.state_types))
+    table = bytearray(256)
+    for byte in range(128):
+        table[byte] = ord(tables.char_classes[byte])
+
+    continuation = tables.class_for_column(tuple(states))
+    samples = [tables.transitions[state] for state in states]
+    sample_classes = [tables.classify(c) for c in 'é²€']
+    lead_column = []
+    for state in states:
+        entries = {samples[state][char_class] for char_class in sample_classes}
+        lead_column.append(entries.pop() if len(entries) == 1 else DECODE << 8 | state)
+    lead = tables.class_for_column(tuple(lead_column))
+
+    for byte in range(0x80, 0xC0):
+        table[byte] = continuation
+    for byte in range(0xC0, 0x100):
+        table[byte] = lead
+    return bytes(table)
+
+_tables = _LexerTables()
+_byte_table = _byte_classes(_tables)
+
+CHUNK_SIZE = 1 << 16
+
+def _decode_at(source, index: int) -> str:
+    lead = source[index]
+    if lead < 0x80:
+        return chr(lead)
+    size = 2 if lead < 0xE0 else 3 if lead < 0xF0 else 4
+    return bytes(source[index:index + size]).decode('utf-8', 'replace')[0]
+
+def _lex(source, binary: bool, chunk_size: int) -> TokenBuffer:
+    transitions = _tables.transitions
+    state_codes = _tables.state_codes
+    char_classes = _tables.char_classes
+    newline = b'\n' if binary else '\n'
+
+    buffer = TokenBuffer(source)
+    append_type = buffer.types.append
+    append_start = buffer.starts.append
+    append_end = buffer.ends.append
+    append_line = buffer.line_starts.append
+
+    state = START
+    start = 0
+    index = 0
+    comment = -1 # Start of the last comment, which ends any token in progress
+    length = len(source)
+
+    line_start = True # No token emitted on the current line yet
+    level = 0 # Number of INDENT tokens at the start of the current line
+    depth = 0 # Indent level of the last line with tokens
+
+    while index < length:
+        # Classify a chunk of input at a time. Tokens and comments may cross chunk boundaries:
+        # only the DFA state and offsets into the source are carried over.
+        base = index
+        chunk_end = min(base + chunk_size, length)
+        if binary:
+            classes = source[base:chunk_end].translate(_byte_table)
+        else:
+            classes = source[base:chunk_end].translate(char_classes).encode('latin-1')
+
+        i = 0
+        chunk_length = chunk_end - base
+        while i < chunk_length:
+            entry = transitions[state][classes[i]]
+
+            if entry <= 0xFF:
+                # Extend the current token
+                state = entry
+                i += 1
                 continue
-        if token_type is None:
-            # New token
-            token_val = c
-            index += 1
-            for typename, validator in token_validators.items():
-                if validator.is_valid_start(c):
-                    token_type = typename
+
+            action = entry >> 8
+            index = base + i
+
+            if action & COMMENT:
+                comment = index
+                index = source.find(newline, index)
+                if index == -1:
+                    index = length
+                if index >= chunk_end:
                     break
-            else: # I actually like that Python for loops have an else clause
-                print(f':: LEXICAL ERROR :: Invalid character: {c}')
+                i = index - base
                 continue
-                
-    if token_type is not None:
-        if token_type == 'LIT' and token_val[-1] != token_val[0]:
-            print(':: LEXICAL ERROR :: Unterminated literal')
-        if token_type != "ARROW":
-            yield (f'<{token_type}, "{token_val}">')
+
+            if action & DECODE:
+                c = _decode_at(source, index)
+                entry = transitions[state][ord(char_classes[ord(c)])]
+                if entry <= 0xFF:
+                    state = entry
+                    i += 1
+                    continue
+                action = entry >> 8
+
+            if action & (EMIT | EMIT_INCLUSIVE):
+                code = state_codes[state]
+                if code == INDENT_CODE:
+                    if line_start:
+                        level += 1
+                else:
+                    if line_start:
+                        line_start = False
+                        while depth < level:
+                            buffer.append(INDENT_CODE, start, start)
+                            depth += 1
+                        while depth > level:
+                            buffer.append(DEDENT_CODE, start, start)
+                            depth -= 1
+
+                    append_type(code)
+                    append_start(start)
+                    if action & EMIT:
+                        append_end(comment if comment > start else index)
+                    else:
+                        append_end(index + 1)
+            elif action & BROKEN_ARROW:
+                buffer.errors.append(('broken arrow', start))
+
+            if action & INVALID:
+                c = _decode_at(source, index) if binary else source[index]
+                buffer.errors.append((f'Invalid character: {c}', index))
+
+            if action & NEWLINE:
+                append_line(index + 1)
+                if not line_start:
+                    buffer.append(NEWLINE_CODE, index, index)
+                    line_start = True
+                level = 0
+
+            state = entry & 0xFF
+            start = index
+            i += 1
         else:
-            print(':: LEXICAL ERROR :: broken arrow')
+            index = chunk_end
+
+    eof_action = _tables.eof_actions[state]
+    if eof_action & EOF_UNTERMINATED:
+        buffer.errors.append(('Unterminated literal', start))
+    if eof_action & EOF_EMIT and state_codes[state] != INDENT_CODE:
+        if line_start:
+            line_start = False
+            while depth < level:
+                buffer.append(INDENT_CODE, start, start)
+                depth += 1
+            while depth > level:
+                buffer.append(DEDENT_CODE, start, start)
+                depth -= 1
+        buffer.append(state_codes[state], start, comment if comment > start else length)
+    elif eof_action & EOF_BROKEN_ARROW:
+        buffer.errors.append(('broken arrow', start))
+
+    if not line_start:
+        buffer.append(NEWLINE_CODE, length, length)
+    while depth > 0:
+        buffer.append(DEDENT_CODE, length, length)
+        depth -= 1
+
+    return buffer
+
+def print_errors(buffer: TokenBuffer):
+    for message, _ in buffer.errors:
+        print(f':: LEXICAL ERROR :: {message}')
+
+def lex(string: str, chunk_size: int = CHUNK_SIZE, report_errors=True) -> TokenBuffer:
+    '''
+    Tokenizes the string into a TokenBuffer. Lexical errors are recorded in the buffer's errors and,
+    unless report_errors is False, printed.
+    Leading INDENT tokens are turned into block structure: every line that has tokens ends with a NEWLINE,
+    and lines indented deeper or shallower than the previous one start with INDENT or DEDENT tokens.
+    Whitespace that doesn't start a line is dropped.
+    '''
+
+    buffer = _lex(string, False, chunk_size)
+    if report_errors:
+        print_errors(buffer)
+    return buffer
+
+def lex_bytes(data, chunk_size: int = CHUNK_SIZE, report_errors=True) -> TokenBuffer:
+    '''
+    Tokenizes UTF-8 encoded input (bytes or any buffer supporting slicing and find, like an mmap).
+    Token offsets are byte offsets, and values are decoded when they are read.
+    '''
+
+    buffer = _lex(data, True, chunk_size)
+    if report_errors:
+        print_errors(buffer)
+    return buffer
+
+def lex_file(path: str, chunk_size: int = CHUNK_SIZE, report_errors=True) -> TokenBuffer:
+    '''
+    Tokenizes a file without reading it into memory: the file is mmap'd and classified one chunk at a time
+    '''
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return lex_bytes(b'', chunk_size, report_errors)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return lex_bytes(data, chunk_size, report_errors)
+
+def tokenize(string: str):
+    yield from lex(string)
+
+def token_repr(token: Token) -> str:
+    '''
+    Serializes a token to the textual <TYPE, "value"> format read by parser.py
+    '''
+
+    return f'<{token.type}, "{token.value}">'
+
+def main():
+    if len(sys.argv) < 2:
+        print('Usage: python lexical_analyser.py <file>')
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as f:
+        for token in tokenize(f.read()):
+            print(token_repr(token))
+
+if __name__ == '__main__':
+    main()
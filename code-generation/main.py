@@ -1,53 +1,231 @@
 import sys
 import os
-from lexical_analyser import tokenize
-from parser import parse, TokenStream, parse_token_repr
-from syntax_tree import print_tree
-from layers import parse_ast, Context, semanticAssert, SemanticError
-from xml.etree.ElementTree import tostring as xml_to_string
+import io
+import math
+import time
+import pickle
+import argparse
+import multiprocessing
+from lexical_analyser import lex_file
+from parser import parse, TokenStream, ParsingError
+from layers import parse_ast, analyze_layers, get_canvas_node, simplify_layers, mark_static_layers, attach_render_caches, precompute_timelines, Context, SemanticError
+from diagnostics import Diagnostic, LEXICAL, SEMANTIC, is_fatal, format_report, json_report
+from incremental import IncrementalCompiler
+from compile_cache import CompileCache, compile_cached, DEFAULT_CACHE_DIR, DEFAULT_MAX_SIZE
+from display_list import DisplayList
+import svg
 import optimizer
 
-def main():
-    if len(sys.argv) != 3:
-        print('Usage: python main.py <input_file> <output_dir>')
-        sys.exit(1)
-        
-    input_file = sys.argv[1]
-    with open(input_file, 'r') as f:
-        tokens = TokenStream(map(parse_token_repr, tokenize(f.read())))
-    
-    output_dir = sys.argv[2]
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+CHUNKS_PER_JOB = 4 # Frame chunks per worker process with --jobs, so workers finishing early take on more
+
+class FrameRenderer:
+    '''
+    Writes the frames of a canvas as SVG files. Static subtrees are only rendered for the first frame written,
+    and a fully static canvas is only rendered once.
+    '''
+
+    def __init__(self, canvas):
+        mark_static_layers(canvas)
+        attach_render_caches(canvas)
+        precompute_timelines(canvas, canvas.length)
+        self.canvas = canvas
+        self.context = Context()
+        self.svg_string = None
 
-    ast = parse(tokens)
-    # print_tree(ast)
-    
-    semanticAssert(len(ast.children) == 1, 'Multiple top-level layers')
-    
-    top_layer = ast.children[0]
-    semanticAssert(top_layer.name == 'Canvas', 'Top-level layer must be a Canvas')
-    
-    canvas = parse_ast(top_layer)
-    base_context = Context()
-    
-    for frame in range(canvas.length):
-        base_context.frame = frame
-        svg = optimizer.optimize_svg(canvas.to_svg(base_context))
-        
+    def write(self, frame: int, output_dir: str):
+        canvas = self.canvas
         with open(f'{output_dir}/{str(frame + 1).zfill(4)}.svg', 'w') as f:
             # Write MIML comment
             f.write('<!-- Generated by MIML v0.1 -->\n')
-            f.write(xml_to_string(svg).decode('utf-8'))
-            
-        print(f'Saved frame {frame + 1}/{canvas.length}')
+            if self.svg_string is not None:
+                f.write(self.svg_string)
+                return
+
+            # The SVG is written straight from the display list, which has no groups for the SVG optimizer to
+            # fold, once translations are baked into coordinates
+            self.context.frame = frame
+            commands = DisplayList()
+            canvas.render(self.context, commands)
+            commands = optimizer.fold_translations(commands)
+            if canvas.static:
+                buffer = io.StringIO()
+                svg.write(buffer, commands, canvas.width, canvas.height)
+                self.svg_string = buffer.getvalue()
+                f.write(self.svg_string)
+            else:
+                svg.write(f, commands, canvas.width, canvas.height)
+
+# The renderer of a worker process, created once from the pickled canvas
+_worker_renderer = None
+
+def _start_worker(canvas_data: bytes):
+    global _worker_renderer
+    _worker_renderer = FrameRenderer(pickle.loads(canvas_data))
+
+def _write_chunk(chunk: tuple) -> range:
+    output_dir, frames = chunk
+    for frame in frames:
+        _worker_renderer.write(frame, output_dir)
+    return frames
+
+def render(canvas, output_dir, jobs=1):
+    '''
+    Writes the frames of the canvas to output_dir. With more than one job, the layer tree is pickled and sent to
+    that many worker processes once, which write chunks of consecutive frames concurrently. Every frame renders
+    the same whichever process writes it, and progress is reported in frame order either way.
+    '''
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Layers that don't change what is drawn are simplified away once, instead of optimizing the SVG of every frame
+    canvas = simplify_layers(canvas)
+
+    canvas_data = None
+    if jobs > 1 and canvas.length > 1:
+        try:
+            canvas_data = pickle.dumps(canvas, protocol=pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            print('Layer tree too deep to send to worker processes, rendering in this one')
+
+    if canvas_data is None:
+        renderer = FrameRenderer(canvas)
+        for frame in range(canvas.length):
+            renderer.write(frame, output_dir)
+            print(f'Saved frame {frame + 1}/{canvas.length}')
+    else:
+        chunk_size = math.ceil(canvas.length / (jobs * CHUNKS_PER_JOB))
+        chunks = [(output_dir, range(start, min(start + chunk_size, canvas.length)))
+                  for start in range(0, canvas.length, chunk_size)]
+        with multiprocessing.Pool(jobs, _start_worker, (canvas_data,)) as pool:
+            # Chunks are written as soon as a worker gets to them, but reported in order
+            for frames in pool.imap(_write_chunk, chunks):
+                for frame in frames:
+                    print(f'Saved frame {frame + 1}/{canvas.length}')
 
     with open(f'{output_dir}/config.txt', 'w') as f:
         f.write(f'{canvas.length}\n200')
-    
+
+def report(diagnostics, input_file, as_json=False):
+    if as_json:
+        print(json_report(diagnostics, input_file))
+    elif diagnostics:
+        print(format_report(diagnostics, input_file))
+
+def watch(input_file, output_dir, jobs=1, check=False, as_json=False):
+    '''
+    Re-renders the animation every time the input file changes, recompiling only the edited blocks.
+    With check, reports the errors of the file every time it changes instead, without rendering it.
+    '''
+
+    compiler = None # Created by the first compile that succeeds, then updated
+    last_modified = None
+    print(f'Watching {input_file} for changes')
+    while True:
+        modified = os.stat(input_file).st_mtime
+        if modified == last_modified:
+            time.sleep(0.5)
+            continue
+        last_modified = modified
+
+        if check:
+            _, diagnostics = compile_file(input_file)
+            report(diagnostics, input_file, as_json)
+            if not diagnostics and not as_json:
+                print(f'No errors in {input_file}')
+            continue
+
+        with open(input_file, 'r') as f:
+            source = f.read()
+
+        start = time.perf_counter()
+        try:
+            if compiler is None:
+                compiler = IncrementalCompiler(source)
+                canvas = compiler.canvas
+            else:
+                canvas = compiler.update(source)
+                print(f'Recompiled in {(time.perf_counter() - start) * 1000:.1f} ms')
+        except (ParsingError, SemanticError) as e:
+            # Keep watching until the file compiles again
+            print(f'{type(e).__name__}: {e}')
+            continue
+
+        render(canvas, output_dir, jobs)
+
+def compile_file(input_file):
+    '''
+    Compiles a scene, collecting all lexical, syntax and semantic errors instead of stopping at the first one.
+    Returns the Canvas layer (None if there are syntax or semantic errors) and the diagnostics.
+    '''
+
+    buffer = lex_file(input_file, report_errors=False)
+    diagnostics = [Diagnostic(LEXICAL, message, buffer.offset_position(offset)) for message, offset in buffer.errors]
+
+    ast = parse(TokenStream(buffer), diagnostics)
+
+    try:
+        canvas_node = get_canvas_node(ast)
+    except SemanticError as e:
+        diagnostics.append(Diagnostic(SEMANTIC, e.message, e.position))
+        canvas_node = None
+
+    # Check every top-level layer, even if the file doesn't have a single Canvas
+    canvas = None
+    for node in ast:
+        layer = parse_ast(node, diagnostics=diagnostics)
+        if layer is not None:
+            analyze_layers(layer, diagnostics)
+        if node is canvas_node:
+            canvas = layer
+
+    if is_fatal(diagnostics):
+        canvas = None
+    return canvas, diagnostics
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Compiles a MINM scene into a folder of SVG frames')
+    arg_parser.add_argument('input_file')
+    arg_parser.add_argument('output_dir', nargs='?', help='folder the SVG frames are written to, not needed with --check')
+    arg_parser.add_argument('--watch', action='store_true', help='keep running and re-render whenever the input file changes')
+    arg_parser.add_argument('--check', action='store_true', help='only report the errors of the input file, without rendering it')
+    arg_parser.add_argument('--json', action='store_true', help='report errors as JSON')
+    arg_parser.add_argument('--no-cache', action='store_true', help='always compile the input file, without reading or writing the compile cache')
+    arg_parser.add_argument('--clear-cache', action='store_true', help='remove all compiled scenes from the cache before compiling')
+    arg_parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR, help=f'directory of the compile cache (default: {DEFAULT_CACHE_DIR})')
+    arg_parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering frames in parallel, 0 for one per CPU (default: 1)')
+    arg_parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // 2**20, help=f'maximum size of the compile cache in MB (default: {DEFAULT_MAX_SIZE // 2**20})')
+    args = arg_parser.parse_args()
+
+    input_file = args.input_file
+    output_dir = args.output_dir
+    if output_dir is None and not args.check:
+        arg_parser.error('the following arguments are required: output_dir')
+    if args.jobs < 0:
+        arg_parser.error('--jobs must be at least 0')
+    jobs = args.jobs or os.cpu_count() or 1
+
+    cache = CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.clear_cache:
+        cache.clear()
+
+    if args.watch:
+        watch(input_file, output_dir, jobs, args.check, args.json)
+        return
+
+    canvas, diagnostics = compile_cached(input_file, compile_file, None if args.no_cache else cache)
+    report(diagnostics, input_file, args.json)
+
+    if canvas is None:
+        sys.exit(1)
+    if not args.check:
+        render(canvas, output_dir, jobs)
+
 if __name__ == '__main__':
     try:
         main()
     except SemanticError as e:
         print("Semantic Error:", e)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
@@ -1,9 +1,16 @@
 import xml.etree.ElementTree as ET
+from typing import List
+from display_list import DisplayList, LINE, USE, IDENTITY, is_translation
+
+# Groups outside of <defs>, whose content is only drawn where it's referenced and must be left as is
+def drawn_groups(root: ET) -> list:
+    defined = {id(group) for defs in root.iter('defs') for group in defs.iter('g')}
+    return [group for group in root.findall('.//g') if id(group) not in defined]
 
 # Remove groups that don't have any attributes
 # Move their children to the parent group
 def remove_redundant_groups(root: ET) -> ET:
-    for group in root.findall('.//g'):
+    for group in drawn_groups(root):
         if not group.attrib:  # Check if the group has no attributes
             for child in list(group):
                 root.append(child)
@@ -16,7 +23,7 @@ def remove_redundant_groups(root: ET) -> ET:
 # If a group only has one child, remove the group and move the child to the parent group
 # Apply the group's attributes to the child
 def remove_single_child_groups(root: ET) -> ET:
-    for group in root.findall('.//g'):
+    for group in drawn_groups(root):
         if len(group) == 1:
             child = group[0]
             for key, value in group.attrib.items():
@@ -40,4 +47,88 @@ def optimize_svg(svg_tree: ET) -> ET:
         return optimize_svg(svg_tree)
     
     return svg_tree
-    
\ No newline at end of file
+
+# Passes over display lists, before they are written
+
+# Largest integer that floats hold exactly along with all the smaller ones
+_EXACT_INTEGER = 2 ** 53
+
+def exact_sum(x, offset):
+    '''
+    x + offset if both are plain numbers and the sum is exact, otherwise None
+    '''
+
+    if type(x) is int and type(offset) is int:
+        return x + offset
+    for value in (x, offset):
+        if type(value) is not float and (type(value) is not int or abs(value) > _EXACT_INTEGER):
+            return None
+    total = x + offset
+    # Nothing was rounded off if the terms can be recovered from the sum (see Knuth's TwoSum)
+    if total - x == offset and total - offset == x:
+        return total
+    return None
+
+def translated(kind: int, geometry: tuple, x, y):
+    # The geometry of a command moved by (x, y), None if it can't be moved exactly
+    if kind == LINE:
+        points = geometry
+        rest = ()
+    else:
+        points = geometry[:2]
+        rest = geometry[2:]
+    moved = tuple(exact_sum(value, y if i % 2 else x) for i, value in enumerate(points))
+    return None if None in moved else moved + rest
+
+def fold_translations(commands: DisplayList) -> DisplayList:
+    '''
+    A copy of a display list drawing the same thing with fewer transforms: commands only translated get the
+    translation added to their coordinates when the sums are exact, and uses of templates that draw nothing are
+    dropped. The list and its templates are left as is, since render caches share them.
+    '''
+
+    templates = commands.templates
+    folded = {} # Folded templates by id, None for the ones that draw nothing
+
+    def used_templates(commands: DisplayList) -> List[str]:
+        return [geometry[0] for kind, geometry in zip(commands.kinds, commands.geometry) if kind == USE]
+
+    # Templates are folded before the lists that use them, so uses of templates that draw nothing can be dropped.
+    # Templates can use templates: they are ordered with an explicit stack, children before parents.
+    order = []
+    seen = set()
+    stack = [(None, iter(used_templates(commands)))]
+    while stack:
+        template_id, uses = stack[-1]
+        for used in uses:
+            if used not in seen:
+                seen.add(used)
+                stack.append((used, iter(used_templates(templates[used]))))
+                break
+        else:
+            stack.pop()
+            if template_id is not None:
+                order.append(template_id)
+
+    def fold(commands: DisplayList) -> DisplayList:
+        result = DisplayList()
+        for kind, geometry, style, transform in zip(commands.kinds, commands.geometry, commands.styles,
+                                                    commands.transforms):
+            if kind == USE:
+                if folded[geometry[0]] is None:
+                    continue
+            elif transform != IDENTITY and is_translation(transform):
+                moved = translated(kind, geometry, transform[4], transform[5])
+                if moved is not None:
+                    geometry = moved
+                    transform = IDENTITY
+            result.add(kind, geometry, style, transform)
+        return result
+
+    for template_id in order:
+        template = fold(templates[template_id])
+        folded[template_id] = template if template else None
+
+    result = fold(commands)
+    result.templates = {template_id: template for template_id, template in folded.items() if template is not None}
+    return result
@@ -1,13 +1,14 @@
 import sys
-from collections import namedtuple
 from typing import Iterable, Generator, List, Tuple
-from syntax_tree import Node, print_tree
-
-Token = namedtuple('Token', ['type', 'value'])
+from syntax_tree import CallNode, LayerNode, Identifier
+from tokens import Token, TokenBuffer, token_type_codes
+from diagnostics import Diagnostic, SYNTAX
 
 class TokenStream(Iterable[Token]):
     def __init__(self, tokens: Iterable[Token], index=0):
-        self.tokens = list(tokens)
+        if not isinstance(tokens, TokenBuffer):
+            tokens = TokenBuffer.from_tokens(tokens)
+        self.tokens = tokens
         self.index = index
     
     def __iter__(self):
@@ -38,12 +39,29 @@ class TokenStream(Iterable[Token]):
     def clone(self):
         return TokenStream(self.tokens, self.index)
     
+    def position(self, index=None):
+        '''
+        Returns the (line, column) of the token at the given index (by default the last token read), or None if unknown
+        '''
+        
+        if index is None:
+            index = max(self.index - 1, 0)
+        return self.tokens.position(index)
+    
 class ParsingError(Exception):
-    pass
+    def __init__(self, message, position=None):
+        super().__init__(message)
+        self.message = message
+        self.position = position
+        
+    def __str__(self):
+        if self.position is None:
+            return self.message
+        return f'Line {self.position[0]}, column {self.position[1]}: {self.message}'
 
 def parse_token_repr(token_repr: str) -> Token:
     # Convert <type, "value"> to Token(type, value)
-    token_repr = token_repr.lstrip('<').rstrip('>\n').split(',')
+    token_repr = token_repr.lstrip('<').rstrip('>\n').split(',', 1)
     token_type = token_repr[0].strip()
     token_value = token_repr[1].strip()[1:-1] # Remove quotes
     
@@ -54,55 +72,56 @@ def read_token_stream() -> Generator[Token, None, None]:
     for line in sys.stdin:
         yield parse_token_repr(line.strip())
 
-def next_indent_level(token_stream: TokenStream) -> int:    
-    '''
-    Returns the number of INDENT tokens in the stream and advances the stream to the next non-INDENT token
-    '''
-    
-    indent_level = 0
-    while token_stream.peek().type == 'INDENT':
-        indent_level += 1
-        next(token_stream)
-        
-    return indent_level
-
-def get_indent_level(token_stream: TokenStream) -> int:
-    '''
-    Returns the number of INDENT tokens in the stream without advancing the stream
-    '''
-    
-    return next_indent_level(token_stream.clone())
-           
 def expect(token_stream: TokenStream, token_type: str):
     token = next(token_stream)
     if token.type != token_type:
-        raise ParsingError(f'Expected {token_type}, got {token.type}')
+        raise ParsingError(f'Expected {token_type}, got {token.type}', token_stream.position())
     
     return token
 
-def parse_param_value(token_stream: TokenStream) -> Node:
+# Parameter values nest (node parameters like Solid('red'), Dicts), so parse_param_value keeps the containers
+# that are still open on an explicit stack instead of recursing, and nesting depth is only limited by memory.
+# Each stack entry is [kind, container, key], where key is the name the next value is stored under (None for
+# anonymous parameters).
+PARAMS = 0 # Parameter list of a node, like Solid('red'). The container is the node.
+DICT = 1 # Dict waiting for the value of its last key. The container is the dict.
+
+def parse_literal(token: Token, token_stream: TokenStream):
     '''
-    Parses the value of a parameter, like 5 or (1, 2, 3)
-    For named parameters, like width: 5, this is the value part (5)
-    For anonymous parameters, this is the entire parameter
+    Returns the typed value of a literal token: int for numbers, str for string literals, Identifier for IDs
+    '''
+    
+    if token.type == 'NUM':
+        return int(token.value)
+    elif token.type == 'LIT':
+        return token.value[1:-1] # Remove quotes
+    elif token.type == 'ID':
+        return Identifier(token.value)
+    else:
+        raise ParsingError(f'Unexpected {token.type}', token_stream.position())
+
+def parse_value_start(token_stream: TokenStream, stack: list):
+    '''
+    Parses a value that doesn't contain other values, like 5 or (1, 2, 3), and returns it.
+    For a node with parameters or a Dict, pushes it on the stack instead and returns None.
     '''
     
     token = next(token_stream)
     if token.type == 'ID':
-        # Param is new node
-        param_node = Node(token.value)
         next_token = token_stream.peek()
         if next_token.type == 'LPAR':
-            param_node.children = parse_params(token_stream)
+            # Param is new node
+            next(token_stream)
+            stack.append([PARAMS, CallNode(token.value), None])
+            return None
         elif next_token.type not in ['COMMA', 'RPAR']:
-            raise ParsingError(f'Expected LPAR, COMMA or RPAR, got {next_token.type}')
+            raise ParsingError(f'Expected LPAR, COMMA or RPAR, got {next_token.type}', token_stream.position(token_stream.index))
         
-        return param_node
+        return Identifier(token.value)
     elif token.type == 'LPAR': # Tuple
-        tuple_node = Node('Tuple')
+        numbers = []
         while True:
-            num = expect(token_stream, 'NUM')
-            tuple_node.children.append(Node(num.value))
+            numbers.append(int(expect(token_stream, 'NUM').value))
             
             tok = next(token_stream)
             if tok.type == 'COMMA':
@@ -110,103 +129,125 @@ def parse_param_value(token_stream: TokenStream) -> Node:
             elif tok.type == 'RPAR':
                 break
             else:
-                raise ParsingError(f'Expected COMMA or RPAR, got {tok.type}')
-        return tuple_node
+                raise ParsingError(f'Expected COMMA or RPAR, got {tok.type}', token_stream.position())
+        return tuple(numbers)
     elif token.type == 'LBRACE': # Dict
-        dict_node = Node('Dict')
-        while True:
-            entry_node = Node('DictEntry')
-            key = expect(token_stream, 'ID')
-            entry_node.children.append(Node(key.value))
-            
-            expect(token_stream, 'COLON')
-            
-            value_node = parse_param_value(token_stream)
-            entry_node.children.append(value_node)
-            
-            dict_node.children.append(entry_node)
-            
-            tok = next(token_stream)
-            if tok.type == 'COMMA':
-                continue
-            elif tok.type == 'RBRACE':
-                break
-            else:
-                raise ParsingError(f'Expected COMMA or RBRACE, got {tok.type}')
-            
-        return dict_node
+        stack.append([DICT, {}, None])
+        return None
     else:
-        return Node(token.value)
+        return parse_literal(token, token_stream)
 
-def parse_param(token_stream: TokenStream) -> Node:
+def parse_param_start(token_stream: TokenStream, entry: list) -> bool:
     '''
-    Parses a single parameter, like "hello" or width: 5
+    Starts parsing a single parameter, like "hello" or width: 5, storing its name (if any) in the stack entry.
+    Returns False if the parameter list ends instead.
     '''
     
-    node = Node('AnonymousParameter')
+    entry[2] = None
     token = next(token_stream)
 
     if token.type == 'RPAR':
-        return None
+        return False
     elif token.type == 'ID':
         next_token = next(token_stream)
         if next_token.type == 'COLON':
-            node.name = 'NamedParameter'
-            node.children.append(Node(token.value))
-            node.children.append(parse_param_value(token_stream))
+            entry[2] = token.value
         elif next_token.type == 'LPAR':
             # Param is new node
             token_stream.back(2) # Go back before the parameter started
-            node.children.append(parse_param_value(token_stream))
         else:
-            raise ParsingError(f'Expected COLON or LPAR, got {next_token.type}')          
+            raise ParsingError(f'Expected COLON or LPAR, got {next_token.type}', token_stream.position())
         
     else:
         token_stream.back()
-        node.children.append(parse_param_value(token_stream))
     
-    return node
-     
-def parse_params(token_stream: TokenStream) -> List[Node]:
+    return True
+
+def parse_dict_entry_start(token_stream: TokenStream, entry: list):
     '''
-    Parses a list of parameters, like (1, 2, 3) or (width: 5, height: 10)
+    Parses the key of a Dict entry, like width: in {width: 5}, storing it in the stack entry
     '''
     
-    params = []
+    entry[2] = expect(token_stream, 'ID').value
+    expect(token_stream, 'COLON')
+
+def parse_element_start(token_stream: TokenStream, stack: list):
+    '''
+    Starts the next element of the innermost open container. Returns the element's value if it is already complete,
+    the container itself if it was closed instead (like in "()"), or None if another container was opened.
+    '''
     
-    expect(token_stream, 'LPAR')
+    entry = stack[-1]
+    if entry[0] == PARAMS:
+        if not parse_param_start(token_stream, entry):
+            stack.pop()
+            return entry[1]
+    else:
+        parse_dict_entry_start(token_stream, entry)
     
-    while token_stream.hasnext():
-        param = parse_param(token_stream)
-        if param is None:
-            break
+    return parse_value_start(token_stream, stack)
+
+def parse_nested(token_stream: TokenStream, stack: list):
+    '''
+    Parses values until the container at the bottom of the stack is closed, and returns it.
+    With an empty stack, parses a single value and returns it.
+    '''
+    
+    value = None if stack else parse_value_start(token_stream, stack)
+    while True:
+        if value is None:
+            value = parse_element_start(token_stream, stack)
+            continue
         
-        params.append(param)
+        # A value is complete, add it to the innermost container
+        if not stack:
+            return value
         
-        next_token = next(token_stream)
-        if next_token.type == 'COMMA':
-            continue
-        elif next_token.type == 'RPAR':
-            break
+        kind, container, key = stack[-1]
+        tok = next(token_stream)
+        if kind == PARAMS:
+            if key is None:
+                container.params.append(value)
+            else:
+                container.named_params[key] = value
+            if tok.type not in ['COMMA', 'RPAR']:
+                raise ParsingError(f'Expected COMMA or RPAR, got {tok.type}', token_stream.position())
         else:
-            raise ParsingError(f'Expected COMMA or RPAR, got {next_token}')
+            container[key] = value
+            if tok.type not in ['COMMA', 'RBRACE']:
+                raise ParsingError(f'Expected COMMA or RBRACE, got {tok.type}', token_stream.position())
+        
+        if tok.type == 'COMMA':
+            value = None
+        else:
+            stack.pop()
+            value = container
+
+def parse_param_value(token_stream: TokenStream):
+    '''
+    Parses the value of a parameter, like 5 or (1, 2, 3)
+    For named parameters, like width: 5, this is the value part (5)
+    '''
     
-    return params
+    return parse_nested(token_stream, [])
+     
+def parse_params(token_stream: TokenStream, node: CallNode):
+    '''
+    Parses a list of parameters, like (1, 2, 3) or (width: 5, height: 10), into the node's params and named_params
+    '''
+    
+    expect(token_stream, 'LPAR')
+    parse_nested(token_stream, [[PARAMS, node, None]])
 
-def parse_node(token_stream: TokenStream):
+def parse_node(token_stream: TokenStream) -> LayerNode:
     '''
     Parses a layer node, like Canvas(width: 100, height: 100) and its possible exports
     Does not parse children (stops after one layer node)
     '''
     
     token = expect(token_stream, 'ID')
-    node = Node(token.value)
-    params = parse_params(token_stream)
-    
-    if len(params) > 0:
-        params_node = Node('parameters')
-        params_node.children = params
-        node.children.append(params_node)
+    node = LayerNode(token.value, token_stream.position())
+    parse_params(token_stream, node)
     
     if token_stream.hasnext() and token_stream.peek().type == 'ARROW':
         # Exports
@@ -215,53 +256,101 @@ def parse_node(token_stream: TokenStream):
         exports = []
         while True:
             export = expect(token_stream, 'ID')
-            exports.append(Node(export.value))
+            exports.append(export.value)
             next_token = next(token_stream)
             if next_token.type == 'COMMA':
                 continue
             elif next_token.type == 'RPAR':
                 break
             else:
-                raise ParsingError(f'Expected COMMA or RPAR, got {next_token.type}')
+                raise ParsingError(f'Expected COMMA or RPAR, got {next_token.type}', token_stream.position())
             
-        exports_node = Node('exports')
-        exports_node.children = exports
-        node.children.append(exports_node)
+        node.exports = exports
     
     return node
     
-def parse_children(token_stream: TokenStream, indent_level: int) -> List[Node]:
+NEWLINE_CODE = token_type_codes['NEWLINE']
+
+def skip_line(token_stream: TokenStream, line_start: int):
+    '''
+    Moves the stream past the NEWLINE ending the line that starts at the given index.
+    Lines never contain INDENT or DEDENT tokens, so this resynchronizes at the next line without losing block structure.
+    '''
+    
+    types = token_stream.tokens.types
+    index = line_start
+    while index < len(types) and types[index] != NEWLINE_CODE:
+        index += 1
+    token_stream.index = index + 1
+
+def parse_children(token_stream: TokenStream, diagnostics: List[Diagnostic] = None) -> List[LayerNode]:
     '''
-    Recursively parses all children from the current position in the token stream at the given indent level
+    Parses all layer lines of the current block and their children, up to the DEDENT that closes it or the end of the stream
+    The sibling lists of the enclosing blocks are kept on an explicit stack, so nesting depth is only limited by memory
+    Without diagnostics, the first syntax error is raised. Otherwise, syntax errors are added to diagnostics and parsing
+    resumes at the next line: the invalid line is dropped, and its block is parsed but not attached to any node.
     '''
     
     nodes = []
-    while token_stream.hasnext():
-        try:
-            indent = get_indent_level(token_stream)
-        except StopIteration:
-            break
-        if indent == indent_level:
-            token_stream.skip(indent)
+    siblings = nodes
+    stack = []
+    while True:
+        if not token_stream.hasnext() or token_stream.peek().type == 'DEDENT':
+            if not stack:
+                break
+            
+            # End of a nested block
+            expect(token_stream, 'DEDENT')
+            siblings = stack.pop()
+            continue
+        elif token_stream.peek().type == 'INDENT':
+            error = ParsingError(f'Unexpected indent', token_stream.position(token_stream.index))
+            if diagnostics is None:
+                raise error
             
+            # Parse the over-indented lines as siblings of the current block
+            diagnostics.append(Diagnostic(SYNTAX, error.message, error.position))
+            next(token_stream)
+            stack.append(siblings)
+            continue
+        
+        line_start = token_stream.index
+        try:
             node = parse_node(token_stream)
-            children = parse_children(token_stream, indent_level + 1)
-            if len(children) > 0:
-                children_node = Node('children')
-                children_node.children = children
-                node.children.append(children_node)
-            nodes.append(node)
-        elif indent < indent_level:
-            break
-        else:
-            raise ParsingError(f'Unexpected indent')
+            expect(token_stream, 'NEWLINE')
+            siblings.append(node)
+            children = node.children
+        except ParsingError as error:
+            if diagnostics is None:
+                raise
+            
+            diagnostics.append(Diagnostic(SYNTAX, error.message, error.position))
+            skip_line(token_stream, line_start)
+            children = []
+        
+        if token_stream.hasnext() and token_stream.peek().type == 'INDENT':
+            next(token_stream)
+            stack.append(siblings)
+            siblings = children
         
     return nodes
             
-def parse(token_stream: TokenStream):
-    root = Node('root')
-    root.children = parse_children(token_stream, 0)
-    return root
+def parse(token_stream: TokenStream, diagnostics: List[Diagnostic] = None) -> List[LayerNode]:
+    '''
+    Parses a whole file and returns its top-level layer nodes
+    With diagnostics, syntax errors are collected instead of raised (see parse_children)
+    '''
+    
+    nodes = parse_children(token_stream, diagnostics)
+    while token_stream.hasnext():
+        error = ParsingError(f'Unexpected {token_stream.peek().type}', token_stream.position(token_stream.index))
+        if diagnostics is None:
+            raise error
+        
+        diagnostics.append(Diagnostic(SYNTAX, error.message, error.position))
+        next(token_stream)
+        nodes.extend(parse_children(token_stream, diagnostics))
+    return nodes
         
 def main():
     try:
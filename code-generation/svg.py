@@ -0,0 +1,216 @@
+import xml.etree.ElementTree as ET
+from typing import TextIO
+from display_list import DisplayList, RECT, CIRCLE, LINE, USE, IDENTITY, is_translation
+
+# The SVG backend: turns the display list of a frame into SVG, one element per draw command, either as an element
+# tree (to_element) or written straight to a file as text (write).
+# Templates are written in <defs> right before the first command using them.
+
+SVG_ATTRIBUTES = 'xmlns="http://www.w3.org/2000/svg" version="1.1"'
+
+# What ElementTree escapes, see xml.etree.ElementTree._escape_attrib and _escape_cdata
+_ATTRIBUTE_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+                                    '\r': '&#13;', '\n': '&#10;', '\t': '&#09;'})
+_TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+# Types of the values written as is: almost all geometry, but layer parameters can also be strings
+_NUMBERS = frozenset((int, float))
+
+def format_transform(transform: tuple) -> str:
+    if is_translation(transform):
+        return f'translate({transform[4]}, {transform[5]})'
+    return 'matrix({}, {}, {}, {}, {}, {})'.format(*transform)
+
+def set_style(element: ET.Element, style: tuple, fill=True):
+    fill_color, stroke_color, stroke_width = style
+    if fill and fill_color is not None:
+        element.set('fill', fill_color)
+    if stroke_color is not None:
+        element.set('stroke', stroke_color)
+        element.set('stroke-width', str(stroke_width))
+
+def append_command(parent: ET.Element, kind: int, geometry: tuple, style: tuple, transform: tuple) -> ET.Element:
+    '''
+    Appends the element of a draw command other than USE
+    '''
+
+    if kind == RECT:
+        x, y, width, height = geometry
+        element = ET.SubElement(parent, 'rect', x=str(x), y=str(y), width=str(width), height=str(height))
+        set_style(element, style)
+    elif kind == CIRCLE:
+        x, y, r = geometry
+        element = ET.SubElement(parent, 'circle', cx=str(x), cy=str(y), r=str(r))
+        set_style(element, style)
+    elif kind == LINE:
+        x1, y1, x2, y2 = geometry
+        element = ET.SubElement(parent, 'line', x1=str(x1), y1=str(y1), x2=str(x2), y2=str(y2))
+        set_style(element, style, fill=False)
+    else:
+        x, y, text, size = geometry
+        element = ET.SubElement(parent, 'text', x=str(x), y=str(y))
+        set_style(element, style)
+        element.text = text
+        element.set('font-size', str(size))
+
+    if transform != IDENTITY:
+        element.set('transform', format_transform(transform))
+    return element
+
+def element_id(template_id: str, ids: dict) -> str:
+    '''
+    The id of the element of a template in an SVG document, given the ids of the templates it already defines:
+    templates are numbered in the order they are defined, after the prefix of their id, like 'repeat-1'
+    '''
+
+    element_id = f'{template_id.rsplit("-", 1)[0]}-{len(ids) + 1}'
+    ids[template_id] = element_id
+    return element_id
+
+def append_commands(parent: ET.Element, commands: DisplayList):
+    '''
+    Appends the elements of the commands of a display list to parent
+    '''
+
+    templates = commands.templates
+    ids = {} # Element ids of the templates defined so far, by template id
+
+    # Explicit stack of (parent element, display list, index of the next command), as templates can use templates
+    stack = [(parent, commands, 0)]
+    while stack:
+        parent, commands, i = stack.pop()
+        kinds, geometry, styles, transforms = commands.kinds, commands.geometry, commands.styles, commands.transforms
+        while i < len(kinds):
+            kind = kinds[i]
+            if kind != USE:
+                append_command(parent, kind, geometry[i], styles[i], transforms[i])
+                i += 1
+                continue
+
+            template_id, = geometry[i]
+            if template_id not in ids:
+                # Write the template first, then come back to this command
+                template = ET.SubElement(ET.SubElement(parent, 'defs'), 'g', id=element_id(template_id, ids))
+                stack.append((parent, commands, i))
+                stack.append((template, templates[template_id], 0))
+                break
+
+            use = ET.SubElement(parent, 'use', href=f'#{ids[template_id]}')
+            if is_translation(transforms[i]):
+                use.set('x', str(transforms[i][4]))
+                use.set('y', str(transforms[i][5]))
+            else:
+                use.set('transform', format_transform(transforms[i]))
+            i += 1
+
+def to_element(commands: DisplayList, width, height) -> ET.Element:
+    '''
+    The <svg> element of a frame of the given size
+    '''
+
+    svg = ET.Element('svg', xmlns='http://www.w3.org/2000/svg', version='1.1', width=str(width), height=str(height))
+    append_commands(svg, commands)
+    return svg
+
+def escape(text: str, escapes: dict) -> str:
+    # ElementTree.tostring writes US-ASCII, with character references for anything else
+    text = text.translate(escapes)
+    return text if text.isascii() else text.encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
+def attribute(value) -> str:
+    return escape(str(value), _ATTRIBUTE_ESCAPES)
+
+def attributes(values: tuple) -> tuple:
+    '''
+    The values of a geometry or transform tuple, escaped as attribute values unless they are all numbers
+    '''
+
+    for value in values:
+        if type(value) not in _NUMBERS:
+            return tuple(map(attribute, values))
+    return values
+
+def transform_attribute(transform: tuple) -> str:
+    if attributes(transform) is transform:
+        return format_transform(transform)
+    return attribute(format_transform(transform))
+
+def style_attributes(style: tuple, fill=True) -> str:
+    fill_color, stroke_color, stroke_width = style
+    attributes = ''
+    if fill and fill_color is not None:
+        attributes += f' fill="{attribute(fill_color)}"'
+    if stroke_color is not None:
+        attributes += f' stroke="{attribute(stroke_color)}" stroke-width="{attribute(stroke_width)}"'
+    return attributes
+
+def write(file: TextIO, commands: DisplayList, width, height):
+    '''
+    Writes the <svg> element of a frame to a text file, exactly as ElementTree.tostring writes to_element,
+    without building the element tree
+    '''
+
+    write = file.write
+    write(f'<svg {SVG_ATTRIBUTES} width="{attribute(width)}" height="{attribute(height)}"')
+    if not commands:
+        write(' />')
+        return
+    write('>')
+
+    templates = commands.templates
+    ids = {} # Escaped element ids of the templates defined so far, by template id
+    styles = {} # Attributes of the styles written so far, by (style, fill)
+
+    # Explicit stack of (display list, index of the next command, end tag written after its last command)
+    stack = [(commands, 0, '</svg>')]
+    while stack:
+        commands, i, end = stack.pop()
+        kinds, geometry, transforms = commands.kinds, commands.geometry, commands.transforms
+        while i < len(kinds):
+            kind = kinds[i]
+            transform = transforms[i]
+            if kind == USE:
+                template_id, = geometry[i]
+                if template_id not in ids:
+                    # Write the template first, then come back to this command
+                    template = templates[template_id]
+                    ids[template_id] = escape(element_id(template_id, ids), _ATTRIBUTE_ESCAPES)
+                    write(f'<defs><g id="{ids[template_id]}"')
+                    if template:
+                        write('>')
+                        stack.append((commands, i, end))
+                        stack.append((template, 0, '</g></defs>'))
+                        break
+                    write(' /></defs>')
+
+                if is_translation(transform):
+                    x, y = attributes(transform[4:])
+                    write(f'<use href="#{ids[template_id]}" x="{x}" y="{y}" />')
+                else:
+                    write(f'<use href="#{ids[template_id]}" transform="{transform_attribute(transform)}" />')
+                i += 1
+                continue
+
+            key = (commands.styles[i], kind != LINE)
+            style = styles.get(key)
+            if style is None:
+                style = styles[key] = style_attributes(*key)
+            transform = '' if transform == IDENTITY else f' transform="{transform_attribute(transform)}"'
+
+            if kind == RECT:
+                x, y, width, height = attributes(geometry[i])
+                write(f'<rect x="{x}" y="{y}" width="{width}" height="{height}"{style}{transform} />')
+            elif kind == CIRCLE:
+                x, y, r = attributes(geometry[i])
+                write(f'<circle cx="{x}" cy="{y}" r="{r}"{style}{transform} />')
+            elif kind == LINE:
+                x1, y1, x2, y2 = attributes(geometry[i])
+                write(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}"{style}{transform} />')
+            else:
+                x, y, text, size = geometry[i]
+                x, y = attributes((x, y))
+                start = f'<text x="{x}" y="{y}"{style} font-size="{attribute(size)}"{transform}'
+                write(f'{start}>{escape(text, _TEXT_ESCAPES)}</text>' if text else f'{start} />')
+            i += 1
+        else:
+            write(end)
@@ -1,15 +1,135 @@
+from typing import List
+
 class Node:
     def __init__(self, name):
         self.name = name
         self.children = []
-    
+
+class Identifier(str):
+    '''
+    A bare identifier used as a value, like x in Latex('...', x: x). It is a string, so layers can treat it like
+    one, but it can still be told apart from a string literal.
+    '''
+
+    __slots__ = ()
+
+class CallNode:
+    '''
+    A node with parameters used as a value, like Solid('red')
+    Parameter values are already typed: int, str, Identifier, tuple, dict or CallNode.
+    '''
+
+    __slots__ = ('name', 'params', 'named_params')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.params = []
+        self.named_params = {}
+
+class LayerNode(CallNode):
+    '''
+    A layer line, like Translate(x: 5, y: 5) -> (a, b), with the layer nodes of its block as children
+    Position is the 1-based (line, column) of the layer name, if known.
+    '''
+
+    __slots__ = ('children', 'exports', 'position')
+
+    def __init__(self, name: str, position=None):
+        super().__init__(name)
+        self.children = []
+        self.exports = None
+        self.position = position
+
+def _value_to_node(value, node: Node, stack: list):
+    '''
+    Fills in the generic node of a value, pushing the values it contains on the stack
+    '''
+
+    if isinstance(value, CallNode):
+        node.name = value.name
+        if isinstance(value, LayerNode):
+            _layer_to_node(value, node, stack)
+        else:
+            _params_to_node(value, node.children, stack)
+    elif isinstance(value, tuple):
+        node.name = 'Tuple'
+        node.children = [Node(str(number)) for number in value]
+    elif isinstance(value, dict):
+        node.name = 'Dict'
+        for key, entry_value in value.items():
+            entry_node = Node('DictEntry')
+            entry_node.children.append(Node(key))
+            value_node = Node(None)
+            entry_node.children.append(value_node)
+            stack.append((entry_value, value_node))
+            node.children.append(entry_node)
+    elif isinstance(value, Identifier) or not isinstance(value, str):
+        node.name = str(value)
+    else:
+        node.name = f'"{value}"' if "'" in value else f"'{value}'"
+
+def _params_to_node(call: CallNode, nodes: List[Node], stack: list):
+    for value in call.params:
+        param_node = Node('AnonymousParameter')
+        value_node = Node(None)
+        param_node.children.append(value_node)
+        stack.append((value, value_node))
+        nodes.append(param_node)
+
+    for name, value in call.named_params.items():
+        param_node = Node('NamedParameter')
+        param_node.children.append(Node(name))
+        value_node = Node(None)
+        param_node.children.append(value_node)
+        stack.append((value, value_node))
+        nodes.append(param_node)
+
+def _layer_to_node(layer: LayerNode, node: Node, stack: list):
+    if layer.params or layer.named_params:
+        params_node = Node('parameters')
+        _params_to_node(layer, params_node.children, stack)
+        node.children.append(params_node)
+
+    if layer.exports is not None:
+        exports_node = Node('exports')
+        exports_node.children = [Node(export) for export in layer.exports]
+        node.children.append(exports_node)
+
+    if layer.children:
+        children_node = Node('children')
+        for child in layer.children:
+            child_node = Node(child.name)
+            stack.append((child, child_node))
+            children_node.children.append(child_node)
+        node.children.append(children_node)
+
+def to_node(layers: List[LayerNode]) -> Node:
+    '''
+    Converts the top-level layer nodes returned by the parser to the generic Node shape, where parameters,
+    children and exports are marker child nodes and values are their source text. Used by print_tree.
+    '''
+
+    root = Node('root')
+    stack = []
+    for layer in layers:
+        layer_node = Node(layer.name)
+        stack.append((layer, layer_node))
+        root.children.append(layer_node)
+
+    # Nodes are created before they are filled in, so children stay in order whatever order the stack pops them in
+    while stack:
+        value, node = stack.pop()
+        _value_to_node(value, node, stack)
+
+    return root
+
 def print_tree(root):
     print(root.name)
-    
+
     for i, child in enumerate(root.children):
         print_tree_branch(child, '', i == len(root.children) - 1)
-    
+
 def print_tree_branch(node, prefix='', is_tail=True):
     print(prefix + ('└── ' if is_tail else '├── ') + node.name)
     for i, child in enumerate(node.children):
-        print_tree_branch(child, prefix + ('    ' if is_tail else '│   '), i == len(node.children) - 1)
\ No newline at end of file
+        print_tree_branch(child, prefix + ('    ' if is_tail else '│   '), i == len(node.children) - 1)
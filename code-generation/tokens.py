@@ -1,5 +1,9 @@
+from array import array
+from bisect import bisect_right
 from collections import namedtuple
+from typing import Iterable
 
+Token = namedtuple('Token', ['type', 'value'])
 TokenValidator = namedtuple('TokenType', ['is_valid_start', 'is_valid_content'])
 
 token_validators = {
@@ -48,4 +52,101 @@ token_validators = {
         is_valid_start=lambda c: c == "'" or c == '"',
         is_valid_content=lambda c, tc: len(tc) == 1 or tc[-1] != tc[0]
     )
-}
\ No newline at end of file
+}
+
+# Token types are stored as their index in this list.
+# NEWLINE and DEDENT are produced by the lexer's indentation tracking rather than by a validator.
+token_types = list(token_validators) + ['NEWLINE', 'DEDENT']
+token_type_codes = {token_type: code for code, token_type in enumerate(token_types)}
+
+# Tokens whose value is always the same don't need to be sliced from the source
+fixed_values = {'LPAR': '(', 'RPAR': ')', 'LBRACE': '{', 'RBRACE': '}', 'COLON': ':', 'COMMA': ',',
+                'INDENT': '', 'NEWLINE': '', 'DEDENT': ''}
+_fixed_values_by_code = [fixed_values.get(token_type) for token_type in token_types]
+
+class TokenBuffer:
+    '''
+    Compact token storage: parallel arrays of type codes and start/end offsets into the source.
+    Token values are only sliced from the source when a token is read.
+    The source is either a string or a UTF-8 buffer (bytes, mmap), in which case offsets are byte offsets.
+    '''
+
+    def __init__(self, source: str = ''):
+        self.source = source
+        self.binary = not isinstance(source, str)
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.line_starts = array('I', [0]) # Offset of the first character of every line
+        self.errors = [] # (message, offset) of the lexical errors found in the source
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[Token]) -> 'TokenBuffer':
+        '''
+        Builds a buffer from already materialized tokens, using their concatenated values as the source
+        '''
+
+        buffer = cls()
+        buffer.line_starts = array('I') # Positions are unknown
+        values = []
+        offset = 0
+        for token in tokens:
+            buffer.append(token_type_codes[token.type], offset, offset + len(token.value))
+            values.append(token.value)
+            offset += len(token.value)
+
+        buffer.source = ''.join(values)
+        return buffer
+
+    def append(self, type_code: int, start: int, end: int):
+        self.types.append(type_code)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def type(self, index: int) -> str:
+        return token_types[self.types[index]]
+
+    def value(self, index: int) -> str:
+        fixed_value = _fixed_values_by_code[self.types[index]]
+        if fixed_value is not None:
+            return fixed_value
+        return self._slice(self.starts[index], self.ends[index])
+
+    def _slice(self, start: int, end: int) -> str:
+        if self.binary:
+            return self.source[start:end].decode('utf-8', 'replace')
+        return self.source[start:end]
+
+    def position(self, index: int):
+        '''
+        Returns the 1-based (line, column) of a token, or None if the buffer wasn't built from source.
+        Positions are computed from the line start offsets recorded by the lexer, so they cost nothing until asked for.
+        '''
+
+        return self.offset_position(self.starts[index] if index < len(self.starts) else len(self.source))
+
+    def offset_position(self, offset: int):
+        '''
+        Returns the 1-based (line, column) of an offset into the source, or None if the buffer wasn't built from source
+        '''
+
+        if not self.line_starts:
+            return None
+
+        line = bisect_right(self.line_starts, offset) - 1
+        column = len(self._slice(self.line_starts[line], offset)) + 1
+        return line + 1, column
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index: int) -> Token:
+        type_code = self.types[index]
+        value = _fixed_values_by_code[type_code]
+        if value is None:
+            value = self._slice(self.starts[index], self.ends[index])
+        return Token(token_types[type_code], value)
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]